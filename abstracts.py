@@ -145,5 +145,5 @@ class DataSetBase(dict):
         raise Exception("!!Elflab ERROR!! DataSet class not implemented!!!")
     def sort(self, key):
         raise Exception("!!Elflab ERROR!! DataSet class not implemented!!!")
-    def interpolator(self, x, y):
+    def interpolator(self, x, y, order=1, errors=False):
         raise Exception("!!Elflab ERROR!! DataSet class not implemented!!!")
\ No newline at end of file
@@ -0,0 +1,92 @@
+# Aligning two datasets on a common variable, e.g. a PPMS run and a thermometry log on "time", or two channels on "T" / "H"
+# Everything is done with binary searches in the sorted right-hand set: O((n + m) log m)
+
+import numpy as np
+
+import elflab.datasets as datasets
+
+HOWS = ("asof", "nearest", "interp")
+DIRECTIONS = ("backward", "forward", "nearest")
+
+
+def match(x, reference, direction="backward", tolerance=None):
+    """for each value in x, the index of the matching value in the sorted array reference, and whether there is a match
+    direction = "backward": the last reference <= x; "forward": the first reference >= x; "nearest": the closest one
+    tolerance: maximal |reference - x| for a match"""
+    x = np.asarray(x, dtype=np.float64)
+    n = reference.shape[0]
+    if direction == "backward":
+        index = np.searchsorted(reference, x, side="right") - 1
+    elif direction == "forward":
+        index = np.searchsorted(reference, x, side="left")
+    elif direction == "nearest":
+        after = np.clip(np.searchsorted(reference, x, side="left"), 0, n - 1)
+        before = np.clip(after - 1, 0, n - 1)
+        index = np.where(np.abs(reference[before] - x) <= np.abs(reference[after] - x), before, after)
+    else:
+        raise ValueError("[elflab.analysis.alignment.match] unknown direction \"{}\"".format(direction))
+    matched = (index >= 0) & (index < n) & ~np.isnan(x)
+    index = np.clip(index, 0, max(n - 1, 0))
+    if n == 0:
+        matched[:] = False
+    elif tolerance is not None:
+        with np.errstate(invalid="ignore"):
+            matched &= (np.abs(reference[index] - x) <= tolerance)
+    return (index, matched)
+
+
+def join(left, right, on, how="asof", direction="backward", tolerance=None, keys=None, suffix="_right", drop_unmatched=False):
+    """attach to every row of left the values of right matched on the variable "on"
+    how = "asof": the row of right found by match() with direction / tolerance
+    how = "nearest": same as asof with direction = "nearest"
+    how = "interp": right's columns linearly interpolated at left[on]; no extrapolation, tolerance limits the distance to the nearest point
+    keys: the columns of right to attach, by default all but "on"; clashing names get the suffix
+    rows of left without a match get NaN's, or are dropped if drop_unmatched
+    returns a new dataset with the columns (and errors, where both sets have them) of left, then those of right"""
+    if how not in HOWS:
+        raise ValueError("[elflab.analysis.alignment.join] unknown method \"{}\"".format(how))
+    if how == "nearest":
+        direction = "nearest"
+    if keys is None:
+        keys = [key for key in right if key != on]
+
+    # sort right by the key, leaving out NaN keys, which argsort puts last
+    sorted_right = right.sort(on)
+    reference = sorted_right[on]
+    n = np.count_nonzero(~np.isnan(reference))
+    reference = reference[:n]
+    x = left[on]
+
+    if how == "interp":
+        (index, matched) = match(x, reference, "nearest", tolerance)
+        if n > 0:
+            matched &= (x >= reference[0]) & (x <= reference[-1])
+        def pick(column):
+            return np.interp(x, reference, column[:n]) if n > 0 else np.full(x.shape, np.nan)
+    else:
+        (index, matched) = match(x, reference, direction, tolerance)
+        def pick(column):
+            return column[:n][index] if n > 0 else np.full(x.shape, np.nan)
+
+    names = [key + suffix if key in left else key for key in keys]
+    columns = [(key, left[key]) for key in left] + [(name, pick(sorted_right[key])) for (name, key) in zip(names, keys)]
+    if (left.errors is not None) and (right.errors is not None):
+        errors = {key: left.errors[key] for key in left}
+        errors.update({name: pick(sorted_right.errors[key]) for (name, key) in zip(names, keys)})
+    else:
+        errors = None
+
+    if drop_unmatched:
+        columns = [(key, values[matched]) for (key, values) in columns]
+        if errors is not None:
+            errors = {key: values[matched] for (key, values) in errors.items()}
+    else:
+        columns = [(key, values if key in left else np.where(matched, values, np.nan)) for (key, values) in columns]
+        if errors is not None:
+            errors = {key: (values if key in left else np.where(matched, values, np.nan)) for (key, values) in errors.items()}
+
+    result = datasets.DataSet(columns)
+    result.errors = errors
+    result.titles = {key: left.titles[key] for key in left}
+    result.titles.update({name: right.titles[key] for (name, key) in zip(names, keys)})
+    return result
@@ -0,0 +1,78 @@
+# Batch analysis of many runs: load every file matching a glob, pass it through a pipeline of steps, collect the results
+# Files are spread over a pool of worker processes; the results always come back in the sorted order of the file names.
+#
+#   (data, files) = batch.run("data/2016-*/*.dat", ppms.import_dc, operator.itemgetter(0), transport.split_MR_sweeps, ...)
+#
+# With worker processes, the loader and the steps are pickled: use module-level functions, functools.partial or
+# operator.itemgetter, not lambdas.
+
+import os
+import glob
+import time
+import multiprocessing
+
+import numpy as np
+
+import elflab.datasets as datasets
+
+DEFAULT_SOURCE_KEY = "source"
+
+
+def find(pattern):
+    """the files matching a glob pattern, sorted"""
+    return sorted(path for path in glob.glob(pattern) if os.path.isfile(path))
+
+def process(filename, loader, steps):
+    """load one file and pass it through the steps, each a function of the previous result;
+    returns (result, None), or (None, "error message") if anything failed"""
+    try:
+        result = loader(filename)
+        for step in steps:
+            if result is None:
+                break
+            result = step(result)
+        return (result, None)
+    except Exception as err:
+        return (None, "{}: {}".format(type(err).__name__, err))
+
+def _process(args):
+    return process(*args)
+
+def run(pattern, loader, *steps, processes=0, key=DEFAULT_SOURCE_KEY, progress=True):
+    """load and process every file matching pattern (a glob, or a list of files)
+    loader(filename) returns the data of one file; the steps, applied in order, must end with a DataSet
+    (or None, to leave the file out)
+    processes: the number of worker processes, 0 for one per core, None to work in this process
+    returns (dataset, files): all the results concatenated in file order, with the index in files of the source
+    of every row in the column key; files that failed are reported and left out"""
+    files = find(pattern) if isinstance(pattern, str) else list(pattern)
+    if len(files) == 0:
+        raise ValueError("[elflab.analysis.batch.run] no files to process")
+    jobs = [(filename, loader, steps) for filename in files]
+    t0 = time.time()
+    if processes is None:
+        outputs = map(_process, jobs)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(processes or None)
+        outputs = pool.imap(_process, jobs)     # in order, as soon as each one is ready
+    results = []
+    try:
+        for (i, (result, error)) in enumerate(outputs):
+            if error is not None:
+                print("        [Batch:] ERROR in \"{}\": {}".format(files[i], error))
+            elif result is not None:
+                result[key] = np.full(result.length, float(i))
+                result.titles[key] = key
+                if result.errors is not None:
+                    result.errors[key] = np.zeros(result.length)
+                results.append(result)
+            if progress:
+                print("        [Batch:] {}/{} files, {:.1f} s: {}".format(i + 1, len(files), time.time() - t0, os.path.basename(files[i])))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    if len(results) == 0:
+        raise ValueError("[elflab.analysis.batch.run] no results from any file")
+    return (datasets.concatenate(results), files)
@@ -0,0 +1,263 @@
+# Content-addressed cache of analysis results, so that re-running an analysis on unchanged inputs is close to instant
+# A result is keyed by the name of the function and a hash of its arguments, where
+#   file names (and globs) count by the contents of the files, datasets and arrays by their values.
+# DataSets (alone, or in a tuple / list) are stored as .npz, anything else is pickled; the least recently used
+# entries are deleted once the cache folder grows above max_size.
+# Editing the memoized function itself changes the key, but editing the functions it calls does not:
+# give a version, and change it when results computed before must not be used any more.
+#
+#   import_dc = cache.memoize(ppms.import_dc)
+#   symmetrize = cache.memoize(transport.symmetrize_MR_pairs, version=2)
+#
+#   @cache.memoize
+#   def analyse(filename, width):
+#       ...
+
+import os
+import glob
+import threading
+import warnings
+import json
+import pickle
+import hashlib
+import functools
+
+import numpy as np
+
+import elflab.datasets as datasets
+
+# Constants
+DEFAULT_FOLDER = os.environ.get("ELFLAB_CACHE", os.path.join(os.path.expanduser("~"), ".elflab_cache"))
+DEFAULT_MAX_SIZE = 1 << 30      # bytes
+HASH_BLOCK = 1 << 20            # bytes read at a time when hashing files
+TEMPORARY_SUFFIX = ".tmp"       # entries being written, never listed by entries()
+
+# hashes of files already read: {path: ((size, mtime), hash)}
+_file_hashes = {}
+
+
+def file_hash(path):
+    """sha256 of the contents of a file, remembered while its size and modification time stay the same"""
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    signature = (stat.st_size, stat.st_mtime)
+    known = _file_hashes.get(path)
+    if (known is not None) and (known[0] == signature):
+        return known[1]
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        block = f.read(HASH_BLOCK)
+        while len(block) > 0:
+            hasher.update(block)
+            block = f.read(HASH_BLOCK)
+    digest = hasher.hexdigest()
+    _file_hashes[path] = (signature, digest)
+    return digest
+
+def _fingerprint(value, hasher):
+    # feed a description of value to hasher: contents for files, datasets and arrays, repr() for the rest
+    if isinstance(value, datasets.DataSet):
+        hasher.update(b"DataSet")
+        for key in value:
+            _fingerprint(key, hasher)
+            _fingerprint(np.asarray(value[key]), hasher)
+            if value.errors is not None:
+                _fingerprint(np.asarray(value.errors[key]), hasher)
+    elif isinstance(value, np.ndarray):
+        hasher.update("ndarray{}{}".format(value.dtype.str, value.shape).encode("utf-8"))
+        hasher.update(np.ascontiguousarray(value).view(np.uint8).ravel())
+    elif isinstance(value, str):
+        if any(c in value for c in "*?["):
+            matches = sorted(path for path in glob.glob(value) if os.path.isfile(path))
+        else:
+            matches = [value] if os.path.isfile(value) else []
+        hasher.update(b"str" + value.encode("utf-8"))
+        for path in matches:
+            hasher.update("file{}{}".format(path, file_hash(path)).encode("utf-8"))
+    elif isinstance(value, (list, tuple)):
+        hasher.update("{}{}".format(type(value).__name__, len(value)).encode("utf-8"))
+        for item in value:
+            _fingerprint(item, hasher)
+    elif isinstance(value, dict):
+        hasher.update("dict{}".format(len(value)).encode("utf-8"))
+        for key in sorted(value, key=repr):
+            _fingerprint(key, hasher)
+            _fingerprint(value[key], hasher)
+    elif isinstance(value, functools.partial):
+        hasher.update(b"partial")
+        _fingerprint((value.func, value.args, value.keywords or {}), hasher)
+    elif callable(value):
+        hasher.update("function{}.{}".format(getattr(value, "__module__", ""), getattr(value, "__qualname__", repr(value))).encode("utf-8"))
+        if hasattr(value, "__code__"):
+            # editing the function (or telling apart two lambdas) changes the key; the functions it calls are not hashed
+            _fingerprint_code(value.__code__, hasher)
+    else:
+        hasher.update(repr(value).encode("utf-8"))
+
+def _fingerprint_code(code, hasher):
+    hasher.update(code.co_code)
+    for constant in code.co_consts:
+        if hasattr(constant, "co_code"):
+            _fingerprint_code(constant, hasher)
+        else:
+            hasher.update(repr(constant).encode("utf-8"))
+
+
+# Storage
+def _is_datasets(value):
+    return isinstance(value, datasets.DataSet) or (isinstance(value, (tuple, list)) and (len(value) > 0)
+                                                     and all(isinstance(s, datasets.DataSet) for s in value))
+
+def _extension(value):
+    return ".npz" if _is_datasets(value) else ".pkl"
+
+def _save(f, value):
+    # write value to the open file f, in the format of _extension(value)
+    if not _is_datasets(value):
+        pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        return
+    if isinstance(value, datasets.DataSet):
+        (kind, sets) = ("dataset", [value])
+    else:
+        (kind, sets) = (type(value).__name__, value)
+    arrays = {}
+    description = {"kind": kind, "sets": []}
+    for (i, data) in enumerate(sets):
+        keys = list(data)
+        description["sets"].append({"keys": keys, "titles": {key: data.titles.get(key, key) for key in keys}, "errors": data.errors is not None})
+        for (j, key) in enumerate(keys):
+            arrays["column_{}_{}".format(i, j)] = np.asarray(data[key])
+            if data.errors is not None:
+                arrays["error_{}_{}".format(i, j)] = np.asarray(data.errors[key])
+    arrays["description"] = np.array(json.dumps(description))
+    np.savez(f, **arrays)
+
+def _load(path):
+    if path.endswith(".pkl"):
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    with np.load(path) as arrays:
+        description = json.loads(str(arrays["description"]))
+        sets = []
+        for (i, entry) in enumerate(description["sets"]):
+            data = datasets.DataSet([(key, arrays["column_{}_{}".format(i, j)]) for (j, key) in enumerate(entry["keys"])])
+            if entry["errors"]:
+                data.errors = {key: arrays["error_{}_{}".format(i, j)] for (j, key) in enumerate(entry["keys"])}
+            data.titles = entry["titles"]
+            sets.append(data)
+    if description["kind"] == "dataset":
+        return sets[0]
+    return tuple(sets) if description["kind"] == "tuple" else sets
+
+
+class Cache:
+    """A folder of results keyed by content hashes, with size-based LRU eviction"""
+    def __init__(self, folder=DEFAULT_FOLDER, max_size=DEFAULT_MAX_SIZE):
+        self.folder = folder
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, function, args=(), kwargs=None, version=None):
+        """the hash of a call of function(*args, **kwargs), and of version if given"""
+        hasher = hashlib.sha256()
+        _fingerprint((function, tuple(args), kwargs or {}), hasher)
+        if version is not None:
+            _fingerprint(("version", version), hasher)
+        return hasher.hexdigest()
+
+    def _find(self, key):
+        for extension in (".npz", ".pkl"):
+            path = os.path.join(self.folder, key + extension)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def load(self, key):
+        """(True, result) if key is in the cache, else (False, None)"""
+        path = self._find(key)
+        if path is None:
+            return (False, None)
+        try:
+            value = _load(path)
+        except Exception:
+            # a damaged entry is simply a miss
+            return (False, None)
+        os.utime(path, None)    # the modification time records the last use
+        return (True, value)
+
+    def store(self, key, value):
+        os.makedirs(self.folder, exist_ok=True)
+        # write under a temporary name, then rename, so that readers and evict() never see a partial entry
+        temporary = os.path.join(self.folder, "{}.{}.{}{}".format(key, os.getpid(), threading.get_ident(), TEMPORARY_SUFFIX))
+        try:
+            with open(temporary, "wb") as f:
+                _save(f, value)
+        except BaseException:
+            os.remove(temporary)
+            raise
+        os.replace(temporary, os.path.join(self.folder, key + _extension(value)))
+        self.evict()
+
+    def entries(self):
+        """[(last use, size, path)] of every entry, oldest first"""
+        if not os.path.isdir(self.folder):
+            return []
+        entries = []
+        for name in os.listdir(self.folder):
+            if name.endswith(".npz") or name.endswith(".pkl"):
+                path = os.path.join(self.folder, name)
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return sorted(entries)
+
+    def evict(self):
+        """delete the least recently used entries until the cache fits in max_size"""
+        entries = self.entries()
+        total = sum(size for (used, size, path) in entries)
+        for (used, size, path) in entries:
+            if total <= self.max_size:
+                break
+            os.remove(path)
+            total -= size
+
+    def clear(self):
+        for (used, size, path) in self.entries():
+            os.remove(path)
+
+    def memoize(self, function, version=None):
+        """wrap function so that its results come from the cache whenever the same call was made before
+        version: part of the key, to change when a function called by function was changed"""
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            key = self.key(function, args, kwargs, version)
+            (found, value) = self.load(key)
+            if found:
+                self.hits += 1
+                return value
+            self.misses += 1
+            value = function(*args, **kwargs)
+            try:
+                self.store(key, value)
+            except Exception as err:
+                # the result is still good: a value that cannot be stored only misses the cache next time
+                warnings.warn("[elflab.analysis.cache.Cache.memoize] result of {} not cached: {}: {}".format(
+                    getattr(function, "__qualname__", repr(function)), type(err).__name__, err), RuntimeWarning)
+            return value
+        wrapper.cache = self
+        return wrapper
+
+# the default cache
+_default = None
+
+def default_cache():
+    global _default
+    if _default is None:
+        _default = Cache()
+    return _default
+
+def memoize(function=None, cache=None, version=None):
+    """decorator memoizing function in cache (the default cache if None): @memoize, or @memoize(cache=Cache(...), version=...)"""
+    if function is None:
+        return lambda f: memoize(f, cache, version)
+    return (default_cache() if cache is None else cache).memoize(function, version)
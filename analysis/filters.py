@@ -1,30 +1,206 @@
-import math
-import csv
+import bisect
+import collections
 
 import numpy as np
-import scipy.optimize
-
-from elflab import constants, abstracts
-import elflab.datasets as datasets    
-    
-def median(data, var = None, interval):
-# filter the data with a median filter, per (interval) in (var)
-# if var == None, interval is the number of data point
+import scipy.signal
+
+import elflab.datasets as datasets
+
+
+# Binned statistics: aggregate every column over bins of one variable
+# the set is sorted by the variable (a cached view), every bin is then a contiguous segment reduced with datasets.reduce_segments
+
+def bin_starts(values, width=None, count=None, edges=None):
+    """first index of every non-empty bin of the sorted, NaN-free values, and the number of values binned
+    width: bins of fixed width, starting from the smallest value
+    count: bins of count points each, the last bin also takes the remaining (length % count) points
+    edges: custom bin edges, in increasing order; values outside [edges[0], edges[-1]] are left out"""
+    values = np.asarray(values, dtype=np.float64)
+    n = values.shape[0]
+    if [width, count, edges].count(None) != 2:
+        raise ValueError("[elflab.analysis.filters.bin_starts] give exactly one of width, count or edges")
+    if n == 0:
+        return (np.zeros(0, dtype=np.intp), 0)
+    if count is not None:
+        return (np.arange(max(n // count, 1), dtype=np.intp) * count, n)
+    if width is not None:
+        if width <= 0:
+            raise ValueError("[elflab.analysis.filters.bin_starts] the bin width must be positive")
+        ids = np.floor((values - values[0]) / width)
+        first = 0
+    else:
+        edges = np.asarray(edges, dtype=np.float64)
+        first = int(np.searchsorted(values, edges[0], side="left"))
+        n = int(np.searchsorted(values, edges[-1], side="right"))
+        if n <= first:
+            return (np.zeros(0, dtype=np.intp), first)
+        # the last edge is inclusive, as in np.histogram
+        ids = np.minimum(np.searchsorted(edges, values[first:n], side="right"), edges.shape[0] - 1)
+    starts = np.flatnonzero(np.diff(ids)) + 1 + first
+    return (np.concatenate(([first], starts)).astype(np.intp), n)
+
+def binned(data, var, width=None, count=None, edges=None, reducer="median", error_est=None, count_key=None):
+    """aggregate all the columns of data (var included) over bins of var, see bin_starts(); empty bins are dropped
+    reducer is a name in datasets.REDUCERS ("median", "mean", "std", "se", "count", ...) or any function of one bin
+    new errors are estimated with "error_est", see datasets.reduce_segment_errors(); None propagates the old errors, if any
+    count_key: if given, the name of an added column with the number of points in every bin
+    return the binned dataset"""
+    sorted_data = data.sort(var)
+    n = np.count_nonzero(~np.isnan(sorted_data[var]))    # NaN's are sorted last
+    (starts, stop) = bin_starts(sorted_data[var][:n], width, count, edges)
+    (first, stop) = (starts[0], stop) if starts.shape[0] > 0 else (0, 0)
+    # bin_starts() left out the points before first and after stop
+    starts = starts - first
+    columns = {key: sorted_data[key][first:stop] for key in data}
+    errors = None if data.errors is None else {key: sorted_data.errors[key][first:stop] for key in data}
+
+    result = datasets.DataSet([(key, datasets.reduce_segments(reducer, columns[key], starts)) for key in data])
+    if (error_est is not None) or (errors is not None):
+        result.errors = {key: datasets.reduce_segment_errors(error_est, columns[key], None if errors is None else errors[key], starts)
+                            for key in data}
+    result.titles = data.titles.copy()
+    if count_key is not None:
+        result[count_key] = np.diff(np.append(starts, stop - first)).astype(np.float64)
+        result.titles[count_key] = count_key
+        if result.errors is not None:
+            result.errors[count_key] = np.zeros(result.length)
+    return result
+
+def median(data, interval, var=None):
+    """filter the data with a median filter, per (interval) in (var)
+    if var is None, interval is the number of data points"""
     if var is None:
-        return datasets.downsample(dataset, size, averaging=np.nanmedian , error_est=None)
+        return datasets.downsample(data, interval, averaging="median", error_est=None)
     else:
-        filtered_lists = {}
-        for key in data:
-            filtered_lists[key] = []
-        sorted = data.sort(var)
-        i1 = 0
-        while i1 < sorted.length:
-            i0 = i1
-            v0 = sorted[var][i0]
-            v1 = v0
-            while (i1 < soorted.length) and (v1 - v0 < interval):
-                i1 += 1
-                v1 = sorted[var][i1]
-            for key in sorted:
-                med = np.nanmedian(sorted[key][v0:v1])
-                filtered_listes[key].append(nan)
\ No newline at end of file
+        return binned(data, var, width=interval, reducer="median")
+
+
+# Streaming filters: stateful filters fed sample by sample while measuring (update), or by arrays / chunks offline (process)
+# Every filter computes a chunk with operations that do not depend on how the stream was cut into chunks,
+# and update(x) is the same computation on a chunk of one, so live and offline results are identical.
+# Non-finite samples give NaN and are otherwise skipped: they never enter the state.
+
+# Median.process() takes the medians of this many window values at a time, for windows of up to
+# MEDIAN_VECTOR_WINDOW samples; longer windows are faster sample by sample, in the sorted window
+MEDIAN_BLOCK_SIZE = 1 << 22
+MEDIAN_VECTOR_WINDOW = 100
+
+class StreamFilter:
+    """Base class for streaming filters"""
+    def process(self, values):
+        """filter the next samples of the stream, returns an array of the same length"""
+        values = np.asarray(values, dtype=np.float64)
+        out = np.full(values.shape, np.nan)
+        finite = np.isfinite(values)
+        if finite.any():
+            out[finite] = self._process(values[finite])
+        return out
+
+    def update(self, x):
+        """filter the next sample"""
+        return float(self.process(np.array([x], dtype=np.float64))[0])
+
+    def _process(self, values):
+        raise Exception("!!Elflab ERROR!! StreamFilter class not implemented!!!")
+
+class MovingAverage(StreamFilter):
+    """Mean of the last window samples (of all the samples so far, at the start), by a running sum: O(1) per sample"""
+    def __init__(self, window):
+        self.window = int(window)
+        self.history = np.zeros(0)  # the last (up to) window samples
+        self.sum = 0.
+        self.count = 0
+
+    def _process(self, values):
+        n = values.shape[0]
+        extended = np.concatenate((self.history, values))
+        leaving = np.arange(self.history.shape[0], extended.shape[0]) - self.window
+        # x_i - x_(i-window); the cumulative sum adds these in order, exactly as one sample at a time would
+        delta = values - np.where(leaving >= 0, extended[np.maximum(leaving, 0)], 0.)
+        sums = np.cumsum(np.concatenate(([self.sum], delta)))[1:]
+        counts = np.minimum(self.count + np.arange(1, n + 1), self.window)
+        self.sum = sums[-1]
+        self.count += n
+        self.history = extended[-self.window:]
+        return sums / counts
+
+class Exponential(StreamFilter):
+    """Exponential moving average y = alpha x + (1 - alpha) y_previous, starting from the first sample: O(1) per sample
+    give alpha, or the time constant tau in samples: alpha = 1 - exp(-1 / tau)"""
+    def __init__(self, alpha=None, tau=None):
+        if (alpha is None) == (tau is None):
+            raise ValueError("[elflab.analysis.filters.Exponential] give either alpha or tau")
+        self.alpha = float(alpha) if tau is None else 1. - np.exp(-1. / tau)
+        self.state = None    # (1 - alpha) y_previous, as the filter state of lfilter
+
+    def _process(self, values):
+        if self.state is None:
+            self.state = np.array([(1. - self.alpha) * values[0]])
+        (out, self.state) = scipy.signal.lfilter([self.alpha], [1., self.alpha - 1.], values, zi=self.state)
+        return out
+
+class Median(StreamFilter):
+    """Median of the last window samples (of all the samples so far, at the start)
+    update() keeps the window sorted: O(log w) search per sample; process() selects in whole windows at once
+    (in blocks of MEDIAN_BLOCK_SIZE values), or goes through update() for windows above MEDIAN_VECTOR_WINDOW.
+    A median is one of the samples (or the mean of the two middle ones, computed alike), so both give identical results"""
+    def __init__(self, window):
+        self.window = int(window)
+        self.recent = collections.deque()
+        self.sorted = []
+
+    @staticmethod
+    def _median(ordered):
+        n = len(ordered)
+        return ordered[n // 2] if n % 2 == 1 else 0.5 * (ordered[n // 2 - 1] + ordered[n // 2])
+
+    def update(self, x):
+        x = float(x)
+        if not np.isfinite(x):
+            return np.nan
+        self.recent.append(x)
+        bisect.insort(self.sorted, x)
+        if len(self.recent) > self.window:
+            del self.sorted[bisect.bisect_left(self.sorted, self.recent.popleft())]
+        return self._median(self.sorted)
+
+    def _process(self, values):
+        if self.window > MEDIAN_VECTOR_WINDOW:
+            return np.array([self.update(x) for x in values.tolist()])
+        out = np.empty(values.shape[0])
+        # windows still filling up, one at a time
+        start = min(max(self.window - 1 - len(self.recent), 0), values.shape[0])
+        for i in range(start):
+            out[i] = self.update(values[i])
+        if start < values.shape[0]:
+            previous = np.array(self.recent)[len(self.recent) - (self.window - 1):]
+            extended = np.concatenate((previous, values[start:]))
+            windows = np.lib.stride_tricks.sliding_window_view(extended, self.window)
+            # np.median copies the windows it is given: a few at a time, to bound the memory
+            step = max(MEDIAN_BLOCK_SIZE // self.window, 1)
+            for i in range(0, windows.shape[0], step):
+                out[start + i:start + i + step] = np.median(windows[i:i + step], axis=1)
+            self.recent = collections.deque(extended[-self.window:].tolist())
+            self.sorted = sorted(self.recent)
+        return out
+
+class SavitzkyGolay(StreamFilter):
+    """Causal Savitzky-Golay filter: the least-squares polynomial of degree polyorder through the last window samples,
+    evaluated (or its deriv-th derivative, per sample) at the newest one; NaN until window samples have arrived
+    a fixed FIR filter, summed term by term in the same order for one sample or many: O(window) per sample"""
+    def __init__(self, window, polyorder, deriv=0):
+        self.window = int(window)
+        self.coefficients = scipy.signal.savgol_coeffs(self.window, polyorder, deriv=deriv, pos=self.window - 1, use="dot")
+        self.history = np.zeros(0)
+
+    def _process(self, values):
+        extended = np.concatenate((self.history, values))
+        out = np.full(values.shape[0], np.nan)
+        m = extended.shape[0] - self.window + 1    # complete windows
+        if m > 0:
+            total = np.zeros(m)
+            for (k, c) in enumerate(self.coefficients):
+                total += c * extended[k:k + m]
+            out[values.shape[0] - m:] = total
+        self.history = extended[-(self.window - 1):] if self.window > 1 else np.zeros(0)
+        return out
@@ -0,0 +1,130 @@
+# Lock-in phase: rotating the (X, Y) or (R, theta) readings of a lock-in amplifier by a phase offset, and estimating
+# the offset that puts the signal in phase (in X), over a whole dataset or chunk by chunk, optionally over a region only.
+# Angles are in degrees, as read from the lock-in; rotating by phi adds phi to theta.
+#
+#   phase = lockin.estimate_phase(data, region=datasets.Column("T").between(30., 40.))
+#   rotated = lockin.rotate(data, phase)
+#
+# The phase maximises the in-phase signal sum(X'^2): it is minus the direction of the principal axis of the (X, Y)
+# points, 0.5 atan2(2 Sxy, Sxx - Syy), turned by 180 degrees if needed so that the mean in-phase signal is positive.
+
+import numpy as np
+
+import elflab.datasets as datasets
+
+DEFAULT_X = "X"
+DEFAULT_Y = "Y"
+
+
+def wrap(angle):
+    """angle in degrees, wrapped into [-180, 180)"""
+    return (np.asarray(angle, dtype=np.float64) + 180.) % 360. - 180.
+
+def rotate_xy(x, y, angle):
+    """(X, Y) rotated by angle in degrees"""
+    phi = np.deg2rad(angle)
+    (c, s) = (np.cos(phi), np.sin(phi))
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    return (c * x - s * y, s * x + c * y)
+
+def _xy(data, x, y, r, theta):
+    # the (X, Y) columns, from (R, theta) if r is given
+    if r is None:
+        return (data[x], data[y])
+    phi = np.deg2rad(data[theta])
+    return (data[r] * np.cos(phi), data[r] * np.sin(phi))
+
+
+class PhaseEstimator:
+    """Sums of (X, Y) and of their products, accumulated over any number of chunks; angle is the estimated phase"""
+    def __init__(self, centred=False):
+        self.centred = centred      # use the covariance about the mean point, for signals on top of an offset
+        self.n = 0
+        self.sx = self.sy = self.sxx = self.syy = self.sxy = 0.
+
+    def add(self, x, y):
+        """add the points (x, y), non-finite ones are skipped"""
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        finite = np.isfinite(x) & np.isfinite(y)
+        if not finite.all():
+            (x, y) = (x[finite], y[finite])
+        self.n += x.shape[0]
+        self.sx += np.sum(x)
+        self.sy += np.sum(y)
+        self.sxx += np.dot(x, x)
+        self.syy += np.dot(y, y)
+        self.sxy += np.dot(x, y)
+
+    def add_data(self, data, x=DEFAULT_X, y=DEFAULT_Y, r=None, theta=None, region=None):
+        """add the rows of a dataset (or chunk), or only those in region: anything DataSet.query() takes"""
+        if region is not None:
+            data = data.query(region)
+        self.add(*_xy(data, x, y, r, theta))
+
+    @property
+    def angle(self):
+        if self.n == 0:
+            raise ValueError("[elflab.analysis.lockin.PhaseEstimator] no points to estimate the phase from")
+        (sxx, syy, sxy) = (self.sxx, self.syy, self.sxy)
+        if self.centred:
+            sxx -= self.sx * self.sx / self.n
+            syy -= self.sy * self.sy / self.n
+            sxy -= self.sx * self.sy / self.n
+        axis = 0.5 * np.arctan2(2. * sxy, sxx - syy)
+        if self.sx * np.cos(axis) + self.sy * np.sin(axis) < 0.:
+            axis += np.pi
+        return float(wrap(-np.rad2deg(axis)))
+
+
+def estimate_phase(data, x=DEFAULT_X, y=DEFAULT_Y, r=None, theta=None, region=None, centred=False):
+    """the phase in degrees to rotate by, so that the signal of data (within region, if given) is in X
+    the readings are the columns x, y, or r, theta (in degrees) if r is given"""
+    estimator = PhaseEstimator(centred)
+    estimator.add_data(data, x, y, r, theta, region)
+    return estimator.angle
+
+def estimate_phase_chunks(chunks, x=DEFAULT_X, y=DEFAULT_Y, r=None, theta=None, region=None, centred=False):
+    """estimate_phase() over a stream of chunks, e.g. datasets.iter_csv(); region must be a Condition or a function"""
+    estimator = PhaseEstimator(centred)
+    for chunk in chunks:
+        estimator.add_data(chunk, x, y, r, theta, region)
+    return estimator.angle
+
+def rotate(data, angle, x=DEFAULT_X, y=DEFAULT_Y, r=None, theta=None):
+    """a dataset with the readings rotated by angle in degrees, sharing every other column with data
+    the rotated readings go to the columns x and y (added if missing); from r, theta if r is given, and then
+    theta is shifted by angle too; errors, if any, are propagated"""
+    rotated = datasets.DataSet([(key, data[key]) for key in data])
+    if data.errors is not None:
+        rotated.errors = {key: data.errors[key] for key in data}
+    rotated.titles = data.titles.copy()
+    (new_x, new_y) = rotate_xy(*(_xy(data, x, y, r, theta) + (angle,)))
+    if rotated.errors is not None:
+        phi = np.deg2rad(angle)
+        if r is None:
+            (ex, ey) = (data.errors[x], data.errors[y])
+            (c, s) = (np.cos(phi), np.sin(phi))
+            rotated.errors[x] = np.hypot(c * ex, s * ey)
+            rotated.errors[y] = np.hypot(s * ex, c * ey)
+        else:
+            # R and theta errors are along and across the reading
+            psi = np.deg2rad(data[theta]) + phi
+            (er, etheta) = (data.errors[r], data[r] * np.deg2rad(data.errors[theta]))
+            rotated.errors[x] = np.hypot(np.cos(psi) * er, np.sin(psi) * etheta)
+            rotated.errors[y] = np.hypot(np.sin(psi) * er, np.cos(psi) * etheta)
+    rotated[x] = new_x
+    rotated[y] = new_y
+    if r is not None:
+        rotated[theta] = wrap(data[theta] + angle)
+    for key in (x, y):
+        rotated.titles.setdefault(key, key)
+        if (rotated.errors is not None) and (key not in rotated.errors):
+            rotated.errors[key] = np.zeros(rotated.length)
+    return rotated
+
+def rotate_chunks(chunks, angle, x=DEFAULT_X, y=DEFAULT_Y, r=None, theta=None):
+    """rotate() every chunk of a stream, e.g. as a source for analysis.streaming"""
+    for chunk in chunks:
+        yield rotate(chunk, angle, x, y, r, theta)
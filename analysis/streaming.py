@@ -0,0 +1,141 @@
+# Streaming analysis over datasets larger than memory
+# A source is any iterable of DataSet chunks with identical variables, e.g. datasets.iter_csv, datasets.iter_dataset
+# (for memory-mapped sets), walogger.iter_chunks or compressedlogger.iter_chunks.
+# Steps transform one chunk into another; reducers accumulate statistics chunk by chunk, in constant memory.
+
+import numpy as np
+
+import elflab.datasets as datasets
+
+
+# Pipelines
+def pipeline(source, *steps):
+    """apply steps, functions of a DataSet chunk returning a DataSet (or None to drop the chunk), to every chunk of source
+    returns a new source"""
+    for chunk in source:
+        for step in steps:
+            chunk = step(chunk)
+            if (chunk is None) or (chunk.length == 0):
+                break
+        else:
+            yield chunk
+
+def select(predicate):
+    """a step keeping the rows where predicate(chunk), a boolean array, is True"""
+    def step(chunk):
+        return chunk.take(np.asarray(predicate(chunk), dtype=bool))
+    return step
+
+def between(key, lo=None, hi=None):
+    """a step keeping the rows where lo <= chunk[key] <= hi; None means unbounded"""
+    def predicate(chunk):
+        mask = np.ones(chunk.length, dtype=bool)
+        if lo is not None:
+            mask &= (chunk[key] >= lo)
+        if hi is not None:
+            mask &= (chunk[key] <= hi)
+        return mask
+    return select(predicate)
+
+def assign(key, function):
+    """a step adding (or replacing) the column key with function(chunk); a new column has zero errors, if any"""
+    def step(chunk):
+        chunk[key] = function(chunk)
+        if (chunk.errors is not None) and (key not in chunk.errors):
+            chunk.errors[key] = np.zeros(chunk.length)
+        return chunk
+    return step
+
+
+# Running reducers
+class Reducer:
+    """Base class for running reducers: update() with every chunk, then read result()"""
+    def update(self, chunk):
+        raise Exception("!!Elflab ERROR!! Reducer class not implemented!!!")
+    def result(self):
+        raise Exception("!!Elflab ERROR!! Reducer class not implemented!!!")
+
+class Moments(Reducer):
+    """Running count, mean and standard deviation of columns, ignoring NaN's
+    chunks are merged with the pairwise update of Chan et al., so there's no loss of precision on long runs"""
+    def __init__(self, keys=None):
+        self.keys = keys
+        self.n = {}
+        self.mean = {}
+        self.m2 = {}
+
+    def update(self, chunk):
+        for key in (chunk if self.keys is None else self.keys):
+            values = np.asarray(chunk[key], dtype=np.float64)
+            values = values[~np.isnan(values)]
+            nb = values.shape[0]
+            if nb == 0:
+                continue
+            mb = values.mean()
+            m2b = np.sum((values - mb)**2)
+            na = self.n.get(key, 0)
+            if na == 0:
+                (self.n[key], self.mean[key], self.m2[key]) = (nb, mb, m2b)
+            else:
+                n = na + nb
+                delta = mb - self.mean[key]
+                self.mean[key] += delta * nb / n
+                self.m2[key] += m2b + delta**2 * na * nb / n
+                self.n[key] = n
+
+    def result(self):
+        """{"key": (count, mean, standard deviation)}"""
+        return {key: (self.n[key], self.mean[key], np.sqrt(self.m2[key] / (self.n[key] - 1)) if self.n[key] > 1 else np.nan)
+                    for key in self.n}
+
+class MinMax(Reducer):
+    """Running minimum and maximum of columns, ignoring NaN's"""
+    def __init__(self, keys=None):
+        self.keys = keys
+        self.min = {}
+        self.max = {}
+
+    def update(self, chunk):
+        for key in (chunk if self.keys is None else self.keys):
+            values = chunk[key]
+            if values.shape[0] == 0 or np.isnan(values).all():
+                continue
+            mn = np.nanmin(values)
+            mx = np.nanmax(values)
+            self.min[key] = mn if key not in self.min else min(self.min[key], mn)
+            self.max[key] = mx if key not in self.max else max(self.max[key], mx)
+
+    def result(self):
+        """{"key": (min, max)}"""
+        return {key: (self.min[key], self.max[key]) for key in self.min}
+
+class Histogram(Reducer):
+    """Running histogram of one column over fixed bins: edges as an array, or (min, max, number of bins)"""
+    def __init__(self, key, bins):
+        self.key = key
+        if isinstance(bins, tuple):
+            self.edges = np.linspace(bins[0], bins[1], bins[2] + 1)
+        else:
+            self.edges = np.asarray(bins, dtype=np.float64)
+        self.counts = np.zeros(self.edges.shape[0] - 1, dtype=np.int64)
+
+    def update(self, chunk):
+        self.counts += np.histogram(chunk[self.key], bins=self.edges)[0]
+
+    def result(self):
+        """(counts, edges)"""
+        return (self.counts, self.edges)
+
+def reduce(source, *reducers):
+    """feed every chunk of source to all the reducers, returns their results, in order"""
+    for chunk in source:
+        for reducer in reducers:
+            reducer.update(chunk)
+    return [reducer.result() for reducer in reducers]
+
+def collect(source):
+    """gather a (typically much reduced) source into a single DataSet"""
+    chunks = list(source)
+    if len(chunks) == 0:
+        raise ValueError("[elflab.analysis.streaming.collect] the source is empty")
+    return datasets.concatenate(chunks)
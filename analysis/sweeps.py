@@ -0,0 +1,132 @@
+# Segmenting a measurement into sweeps of one variable, e.g. the loops of a field sweep or the ramps of a temperature cycle
+# The result is an index of row ranges [start, stop) with a direction: +1 rising, -1 falling, 0 flat (plateaus);
+# Sweeps.views() materialises them as zero-copy slices of the dataset.
+
+import numpy as np
+
+UP = 1
+DOWN = -1
+FLAT = 0
+
+
+class Sweeps:
+    """Index of the sweeps of a dataset: row ranges [start, stop) and their directions"""
+    def __init__(self, starts, stops, directions):
+        self.starts = np.asarray(starts, dtype=np.intp)
+        self.stops = np.asarray(stops, dtype=np.intp)
+        self.directions = np.asarray(directions, dtype=np.int8)
+
+    def __len__(self):
+        return self.starts.shape[0]
+
+    def __getitem__(self, i):
+        return (int(self.starts[i]), int(self.stops[i]), int(self.directions[i]))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __repr__(self):
+        return "Sweeps({})".format(list(self))
+
+    def select(self, direction):
+        """the sweeps going in direction (UP, DOWN or FLAT)"""
+        mask = (self.directions == direction)
+        return Sweeps(self.starts[mask], self.stops[mask], self.directions[mask])
+
+    def views(self, dataset):
+        """[DataSet] of every sweep, sharing memory with dataset"""
+        return [dataset.slice(start, stop) for (start, stop, direction) in self]
+
+
+def turning_points(values, tolerance=0.):
+    """indices of the extrema of values where the direction reverses by more than tolerance, in order
+    a reversal within tolerance is taken for noise; the end points are not included"""
+    values = np.asarray(values, dtype=np.float64)
+    steps = np.diff(values)
+    moving = np.flatnonzero(steps)
+    if moving.shape[0] == 0:
+        return np.zeros(0, dtype=np.intp)
+    # only local extrema can become turning points: the first point after the last step in each direction
+    signs = np.sign(steps[moving])
+    extrema = moving[:-1][signs[1:] != signs[:-1]] + 1
+    candidates = np.concatenate(([0], extrema, [values.shape[0] - 1])).tolist()
+    v = values.tolist()
+
+    turns = []
+    direction = 0
+    lo = hi = extreme = 0
+    for i in candidates[1:]:
+        x = v[i]
+        if direction == 0:
+            # direction unknown until the values have moved by more than tolerance
+            if x > v[hi]:
+                hi = i
+            if x < v[lo]:
+                lo = i
+            if v[hi] - v[lo] > tolerance:
+                (direction, extreme) = (UP, hi) if hi > lo else (DOWN, lo)
+        elif direction == UP:
+            if x > v[extreme]:
+                extreme = i
+            elif v[extreme] - x > tolerance:
+                turns.append(extreme)
+                (direction, extreme) = (DOWN, i)
+        else:
+            if x < v[extreme]:
+                extreme = i
+            elif x - v[extreme] > tolerance:
+                turns.append(extreme)
+                (direction, extreme) = (UP, i)
+    return np.array(turns, dtype=np.intp)
+
+
+def plateaus(values, step, min_points=3):
+    """(starts, stops) of the runs of at least min_points points where values change by at most step per point"""
+    flat = np.abs(np.diff(np.asarray(values, dtype=np.float64))) <= step
+    edges = np.diff(np.concatenate(([0], flat.view(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    stops = np.flatnonzero(edges == -1) + 1    # a run of k flat steps spans k + 1 points
+    long_enough = (stops - starts) >= min_points
+    return (starts[long_enough], stops[long_enough])
+
+
+def segment(data, key=None, tolerance=0., plateau=None, min_points=3):
+    """split data (a dataset, with the variable key, or an array) into monotonic sweeps, in one pass
+    tolerance: reversals by no more than tolerance are noise, not turning points
+    plateau: if given, runs of at least min_points points changing by at most plateau per point are flat sweeps
+    NaN's are skipped, and end up within the neighbouring sweep; a turning point starts the next sweep
+    returns Sweeps"""
+    values = np.asarray(data if key is None else data[key], dtype=np.float64)
+    n = values.shape[0]
+    finite = np.flatnonzero(~np.isnan(values))
+    v = values[finite]
+    if v.shape[0] < 2:
+        return Sweeps([0], [n], [FLAT])
+
+    # flat runs first, then the turning points of every span in between, all in indices of v
+    if plateau is None:
+        (flat_starts, flat_stops) = (np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp))
+    else:
+        (flat_starts, flat_stops) = plateaus(v, plateau, min_points)
+    span_starts = np.concatenate(([0], flat_stops))
+    span_stops = np.concatenate((flat_starts, [v.shape[0]]))
+    bounds = []
+    flats = []
+    for (i, (start, stop)) in enumerate(zip(span_starts, span_stops)):
+        if stop > start:
+            bounds.append([start])
+            bounds.append(turning_points(v[start:stop], tolerance) + start)
+        if i < flat_starts.shape[0]:
+            bounds.append([flat_starts[i]])
+            flats.append(flat_starts[i])
+    bounds = np.unique(np.concatenate(bounds).astype(np.intp))
+    stops = np.concatenate((bounds[1:], [v.shape[0]]))
+    directions = np.sign(v[stops - 1] - v[bounds]).astype(np.int8)
+    directions[np.isin(bounds, flats)] = FLAT
+
+    # back to rows of data: every sweep runs up to the start of the next one
+    starts = finite[bounds]
+    starts[0] = 0
+    stops = np.concatenate((starts[1:], [n]))
+    return Sweeps(starts, stops, directions)
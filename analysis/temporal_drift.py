@@ -1,15 +1,131 @@
 # Correcting temporal drifts
 
 import numpy as np
+import scipy.interpolate as interpolate
 
 from elflab import constants, abstracts
 import elflab.datasets as datasets
 
+# a new dataset sharing every column with data
+def _shallow(data):
+    new_set = datasets.DataSet([(key, data[key]) for key in data])
+    if data.errors is not None:
+        new_set.errors = {key: data.errors[key] for key in data}
+    new_set.titles = data.titles.copy()
+    return new_set
+
 # Correcting a linear drift of a quantity vs time
 def linear(data, key, t1, v1, t2, v2): # key is the name of the drifting quantity; (t, v) are two data points defining a linear temporal drifts
     # Define drifts as v_new = v - k(t-t0), where t0 = (t1+t2)/2
     t0 = (t1 + t2) / 2.0
     k = (v2 - v1) / (t2 - t1)
-    shifted = data.duplicate()
-    shifted[key] = data[key] - k * (shifted["time"] - t0)
-    return shifted
\ No newline at end of file
+    shifted = _shallow(data)    # only the drifting quantity is new
+    shifted[key] = data[key] - k * (data["time"] - t0)
+    return shifted
+
+
+# Least-squares drift from many reference segments: time windows (t_start, t_stop) where the quantity should be
+# constant (reference=None), or equal to known reference values (a number, or one per segment).
+# The drift is a polynomial of time fitted to every reference point, or a smoothing spline through the segment means.
+# Reference points can be gathered from a whole dataset or chunk by chunk (iter_csv, iter_dataset of a memory-mapped set),
+# and the correction is applied in blocks, so week-long logs never need more than one block of temporary memory:
+# in place on a set loaded with mmap_mode="r+", or into an on-disk out array.
+
+class Drift:
+    """A fitted drift: drift(t) is what to subtract from the quantity at time t"""
+    def __init__(self, function, offset=0.):
+        self.function = function
+        self.offset = offset
+
+    def __call__(self, t):
+        return self.function(np.asarray(t, dtype=np.float64)) - self.offset
+
+def _segment_index(t, starts, stops):
+    # index of the segment containing each time, -1 outside every segment
+    index = np.searchsorted(starts, t, side="right") - 1
+    inside = (index >= 0) & (t <= stops[np.maximum(index, 0)])
+    return np.where(inside, index, -1)
+
+def reference_points(data, key, segments, reference=None, time_key="time"):
+    """(t, v - reference, segment index) of the finite points of data within the reference segments"""
+    segments = sorted(segments)
+    starts = np.array([start for (start, stop) in segments], dtype=np.float64)
+    stops = np.array([stop for (start, stop) in segments], dtype=np.float64)
+    t = data[time_key]
+    index = _segment_index(t, starts, stops)
+    picked = np.flatnonzero(index >= 0)
+    (t, v, index) = (t[picked], data[key][picked], index[picked])
+    if reference is not None:
+        v = v - np.broadcast_to(np.asarray(reference, dtype=np.float64), (len(segments),))[index]
+    finite = np.isfinite(t) & np.isfinite(v)
+    return (t[finite], v[finite], index[finite])
+
+def fit(points, degree=1, spline=False, relative=True):
+    """fit the drift to reference points (t, y, segment index), from reference_points() or reference_chunks()
+    degree: of the polynomial, or of the spline if spline
+    relative: the references are unknown constants, so the drift keeps the value at the mean reference time"""
+    (t, y, index) = points
+    if t.shape[0] == 0:
+        raise ValueError("[elflab.analysis.temporal_drift.fit] no reference points")
+    if spline:
+        # one weighted point per segment: mean time and value, and the standard error of the value
+        segments = np.unique(index)
+        if segments.shape[0] <= degree:
+            raise ValueError("[elflab.analysis.temporal_drift.fit] a spline of degree {} needs more than {} segments".format(degree, degree))
+        slot = np.searchsorted(segments, index)
+        n = np.bincount(slot).astype(np.float64)
+        tm = np.bincount(slot, t) / n
+        ym = np.bincount(slot, y) / n
+        var = np.bincount(slot, (y - ym[slot])**2) / np.maximum(n - 1., 1.)
+        se = np.sqrt(var / n)
+        se = np.where(se > 0., se, np.min(se[se > 0.]) if (se > 0.).any() else 1.)
+        function = interpolate.UnivariateSpline(tm, ym, w=1. / se, k=degree, s=segments.shape[0])
+    else:
+        function = np.polynomial.Polynomial.fit(t, y, degree)
+    offset = function(np.mean(t)) if relative else 0.
+    return Drift(function, offset)
+
+def fit_drift(data, key, segments, reference=None, degree=1, spline=False, time_key="time"):
+    """fit the drift of key from a dataset, see reference_points() and fit()"""
+    return fit(reference_points(data, key, segments, reference, time_key), degree, spline, relative=(reference is None))
+
+def reference_chunks(chunks, key, segments, reference=None, time_key="time"):
+    """reference_points() gathered chunk by chunk; only the reference points are kept in memory"""
+    parts = [reference_points(chunk, key, segments, reference, time_key) for chunk in chunks]
+    if len(parts) == 0:
+        return (np.zeros(0), np.zeros(0), np.zeros(0, dtype=np.intp))
+    return tuple(np.concatenate([part[i] for part in parts]) for i in range(3))
+
+def correct(data, key, drift, new_key=None, time_key="time", block_rows=datasets.DEFAULT_CHUNK_ROWS, out=None):
+    """subtract drift(time) from key, in place, or into the new column new_key if given, with the errors of key; returns data
+    in place, the column must be writable: open a load_npy() set with mmap_mode="r+" to correct it on disk
+    out: the array for new_key, e.g. np.lib.format.open_memmap(path, "w+", np.float64, (data.length,)) to keep it
+    on disk; a new array in memory if None"""
+    t = data[time_key]
+    v = data[key]
+    if new_key is None:
+        if not v.flags.writeable:
+            raise ValueError("[elflab.analysis.temporal_drift.correct] \"{}\" is read-only: load it with mmap_mode=\"r+\" or give new_key".format(key))
+        out = v
+    elif out is None:
+        out = np.empty(v.shape[0], dtype=np.float64)
+    elif out.shape != v.shape:
+        raise IndexError("[elflab.analysis.temporal_drift.correct] out must have {} values".format(v.shape[0]))
+    for start in range(0, v.shape[0], block_rows):
+        stop = min(start + block_rows, v.shape[0])
+        np.subtract(v[start:stop], drift(t[start:stop]), out=out[start:stop])
+    if isinstance(out, np.memmap):
+        out.flush()
+    if new_key is None:
+        data.touch(key)
+    else:
+        data[new_key] = out
+        data.titles[new_key] = new_key
+        if data.errors is not None:
+            data.errors[new_key] = data.errors[key]     # the drift is subtracted as exact
+    return data
+
+def correct_chunks(chunks, key, drift, new_key=None, time_key="time"):
+    """correct() every chunk of a stream, e.g. as a source for analysis.streaming"""
+    for chunk in chunks:
+        yield correct(chunk, key, drift, new_key, time_key)
@@ -1,14 +1,17 @@
 import math
 import csv
+import multiprocessing
 
 import numpy as np
 import scipy.optimize
 
 from elflab import constants, abstracts
 import elflab.datasets as datasets
+import elflab.analysis.alignment as alignment
+import elflab.analysis.sweeps as sweeps
 
 # For a pair of R's obtained by the van der Pauw method, compute the sheet resistance Rs, using the Brent1973 method
-def van_der_Pauw(R_horizontal, R_vertical, xtol=1e-12, rtol=4.4408920985006262e-16, maxiter=100):
+def van_der_Pauw(R_horizontal, R_vertical, xtol=1e-12, rtol=8.8817841970012523e-16, maxiter=100):
     # Defining the equation f(Rs)=0
     def f(Rs):
         A = math.exp(-constants.pi * R_horizontal / Rs)
@@ -26,28 +29,60 @@ def van_der_Pauw(R_horizontal, R_vertical, xtol=1e-12, rtol=4.4408920985006262e-
     Rs = scipy.optimize.brentq(f, Rmin, Rmax, args=(), xtol=xtol, rtol=rtol, maxiter=maxiter, full_output=False, disp=True)
     return Rs
 
+# The same for whole arrays of R's at once: with R1 <= R2, s = pi * R1 / Rs solves exp(-s) + exp(-s * R2 / R1) = 1,
+# a convex decreasing function of s, bracketed by the same bounds as above: 2 ln2 / (1 + R2 / R1) <= s <= ln2
+# Halley iterations run on the whole array, each one only on the points not converged yet; NaN where R <= 0 or not finite
+def van_der_Pauw_array(R_horizontal, R_vertical, rtol=8.8817841970012523e-16, maxiter=50):
+    (R_horizontal, R_vertical) = np.broadcast_arrays(np.asarray(R_horizontal, dtype=np.float64), np.asarray(R_vertical, dtype=np.float64))
+    shape = R_horizontal.shape
+    R1 = np.minimum(R_horizontal, R_vertical).ravel()
+    R2 = np.maximum(R_horizontal, R_vertical).ravel()
+    valid = (R1 > 0.) & np.isfinite(R2)
+    with np.errstate(invalid="ignore", divide="ignore", over="ignore"):
+        r = np.minimum(np.where(valid, R2 / R1, 1.), 1e300)
+    lo = 2. * constants.ln2 / (1. + r)
+    hi = np.full(r.shape, constants.ln2)
+    s = lo.copy()   # the root for R1 = R2, and below the root otherwise
+    active = np.flatnonzero(valid & (r > 1.))
+    for i in range(maxiter):
+        if active.shape[0] == 0:
+            break
+        (sa, ra) = (s[active], r[active])
+        with np.errstate(invalid="ignore", over="ignore"):
+            A = np.exp(-sa)
+            B = np.exp(-ra * sa)
+            f = A + B - 1.
+            df = -A - ra * B
+            d2f = A + ra * ra * B
+            step = 2. * f * df / (2. * df * df - f * d2f)
+        # f > 0 below the root: tighten the bracket, then a Halley step kept inside it (bisection if it overflowed)
+        below = (f > 0.)
+        lo[active] = np.where(below, sa, lo[active])
+        hi[active] = np.where(below, hi[active], sa)
+        new = np.where(np.isfinite(step), np.clip(sa - step, lo[active], hi[active]), 0.5 * (lo[active] + hi[active]))
+        s[active] = new
+        active = active[(np.abs(new - sa) > rtol * new) & (f != 0.)]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(valid, constants.pi * R1 / s, np.nan).reshape(shape)
+
+# Standard error of the sheet resistances from those of the R's, by implicit differentiation of
+# exp(-pi R1 / Rs) + exp(-pi R2 / Rs) = 1: dRs/dR1 = A Rs / (R1 A + R2 B), with A = exp(-pi R1 / Rs), likewise for R2
+def van_der_Pauw_error(Rs, R_horizontal, R_vertical, err_horizontal, err_vertical):
+    A = np.exp(-constants.pi * R_horizontal / Rs)
+    B = np.exp(-constants.pi * R_vertical / Rs)
+    scale = Rs / (R_horizontal * A + R_vertical * B)
+    return scale * np.sqrt((A * err_horizontal)**2 + (B * err_vertical)**2)
+
 # For a pair of data sets, calculating the sets of sheet resistance by van der Pauw method, using "param" as the interpolation parameter
 def van_der_Pauw_set(set1, set2, param):
-    # sort set2 according to param
-    set2sorted = set2.sort(param)
-    # filter set1 to have param within the range of set2
-    indices = [i for i in range(len(set1[param]))
-                    if (set1[param][i] >= set2sorted[param][0]) and (set1[param][i] <= set2sorted[param][-1])]
-    result = set1.empty()
-    for key in result:
-        result[key] = set1[key][indices]
+    # keep the points of set1 with param within the range of set2, and interpolate set2's R there
+    joined = alignment.join(set1, set2, param, how="interp", keys=["R", "err_R"], suffix="_2", drop_unmatched=True)
+    result = datasets.DataSet([(key, joined[key]) for key in set1])
+    result.titles = set1.titles.copy()
     # Compute VdP sheet resistance
-    set2R = set2sorted.interpolator(param, "R")
-    set2err = set2sorted.interpolator(param, "err_R")
-    for i in range(len(result[param])):
-        x = result[param][i]
-        R1 = result["R"][i]
-        dR1 = result["err_R"][i]
-        R2 = set2R(x)
-        dR2 = set2err(x)
-        Rs = van_der_Pauw(R1, R2)
-        result["R"][i] = Rs
-        result["err_R"][i] = dR1 + dR2  # Very approximately
+    Rs = van_der_Pauw_array(joined["R"], joined["R_2"])
+    result["err_R"] = van_der_Pauw_error(Rs, joined["R"], joined["R_2"], joined["err_R"], joined["err_R_2"])
+    result["R"] = Rs
     return result
 
 # Split MR into down and up sweeps
@@ -73,43 +108,48 @@ def split_MR_zero(data):
     return (a, b)
 
     
+# Split MR into all its down and up sweeps, for multi-loop field sweeps, as views of data
+def split_MR_sweeps(data, tolerance=0.):
+    index = sweeps.segment(data, "H", tolerance)
+    return (index.select(sweeps.DOWN).views(data), index.select(sweeps.UP).views(data))
+
+    
 # Symmetrise / Antisymmetrise magnetoresistance data, by default using linear interpolation
-def symmetrize_MR(data, mirror, spline_order=1):    # data and its mirror
-    # Sort the mirror set by H
+def _mirror_combine(data, mirror, sign, spline_order):
+    # only the data points where -H is in range of the mirror
     sorted_mirror = mirror.sort("H")
-    # prepare the interpolators
+    mirror_H = sorted_mirror["H"][~np.isnan(sorted_mirror["H"])]
+    result = data.take((data["H"] <= -mirror_H[0]) & (data["H"] >= -mirror_H[-1]))
+    # the mirror's interpolators are cached; order 1 evaluates with np.interp
     mirror_R = mirror.interpolator("H", "R", order=spline_order)
     mirror_err_R = mirror.interpolator("H", "err_R", order=spline_order)
     
-    # filtering through data, only getting data points where H is in range of the mirror
-    indices = [i for i in range(len(data["H"]))
-                    if (data["H"][i] <= -(sorted_mirror["H"][0])) and (data["H"][i] >= -(sorted_mirror["H"][-1]))]
-    result = data.empty()
-    for key in data:
-        result[key] = data[key][indices]
-        
-    # compute symmetrized R and its standard error
-    result["R"] = 0.5 * (result["R"] + mirror_R(-result["H"]))
+    # compute (anti)symmetrized R and its standard error
+    result["R"] = 0.5 * (result["R"] + sign * mirror_R(-result["H"]))
     result["err_R"] = 0.5 * (result["err_R"]**2 + mirror_err_R(-result["H"])**2)**0.5
-    
     return result
     
-def antisymmetrize_MR(data, mirror, spline_order=1):    # data and its mirror
-    # Sort the mirror set by H
-    sorted_mirror = mirror.sort("H")
-    # prepare the interpolators
-    mirror_R = mirror.interpolator("H", "R", order=spline_order)
-    mirror_err_R = mirror.interpolator("H", "err_R", order=spline_order)
+def symmetrize_MR(data, mirror, spline_order=1):    # data and its mirror
+    return _mirror_combine(data, mirror, 1., spline_order)
     
-    # filtering through data, only getting data points where H is in range of the mirror
-    indices = [i for i in range(len(data["H"]))
-                    if (data["H"][i] <= -(sorted_mirror["H"][0])) and (data["H"][i] >= -(sorted_mirror["H"][-1]))]
-    result = data.empty()
-    for key in data:
-        result[key] = data[key][indices]
-        
-    # compute symmetrized R and its standard error
-    result["R"] = 0.5 * (result["R"] - mirror_R(-result["H"]))
-    result["err_R"] = 0.5 * (result["err_R"]**2 + mirror_err_R(-result["H"])**2)**0.5
+def antisymmetrize_MR(data, mirror, spline_order=1):    # data and its mirror
+    return _mirror_combine(data, mirror, -1., spline_order)
     
-    return result
+# (Anti)symmetrise many pairs of sweeps, e.g. the down and up sweeps from split_MR_sweeps(), paired
+# processes: None to work in this process, or the number of worker processes (0 for one per core)
+# returns all the results in one dataset, with the number of the pair in the column "key";
+# average them over field with filters.binned(result, "H", width, reducer="mean") to combine the errors as well
+def symmetrize_MR_pairs(pairs, antisymmetric=False, spline_order=1, processes=None, key="sweep"):
+    sign = -1. if antisymmetric else 1.
+    args = [(data, mirror, sign, spline_order) for (data, mirror) in pairs]
+    if processes is None:
+        results = [_mirror_combine(*arg) for arg in args]
+    else:
+        with multiprocessing.Pool(processes or None) as pool:
+            results = pool.starmap(_mirror_combine, args)
+    for (i, result) in enumerate(results):
+        result[key] = np.full(result.length, float(i))
+        result.titles[key] = key
+        if result.errors is not None:
+            result.errors[key] = np.zeros(result.length)
+    return datasets.concatenate(results)
@@ -0,0 +1,280 @@
+""" A Logger writing a compressed stream with the standard library codecs (gzip / lzma / bz2)
+    Formatting, encoding and compression all happen in a background thread: log() only queues the values.
+    Every save_interval the queued records are written and made readable on disk: a sync flush for gzip,
+    a new stream for lzma and bz2, whose readers join the streams; a crash loses at most the last save_interval.
+
+    Two encodings are available:
+        "csv": the same text as the csvlogger, compressed; datasets.load_csv reads it transparently
+        "binary": blocks of float64 columns, optionally transformed before compression to help the codec:
+            "delta": successive differences of the IEEE-754 bit patterns, lossless
+            "shuffle": each column split into its 8 byte planes
+            "delta+shuffle": both
+        read back with load() / iter_blocks()
+"""
+
+import os
+import csv
+import json
+import lzma
+import time
+import struct
+import tempfile
+import threading
+import queue
+
+import numpy as np
+
+from elflab import abstracts
+import elflab.datasets as datasets
+
+# Constants
+MAGIC = b"ELFZ0001"
+DEFAULT_BLOCK_RECORDS = 4096
+DEFAULT_SAVE_INTERVAL = 10.     # in s
+TRANSFORMS = (None, "delta", "shuffle", "delta+shuffle")
+EXTENSIONS = {"gzip": ".gz", "lzma": ".xz", "bz2": ".bz2"}
+
+_UINT32 = struct.Struct("<I")
+_SAVE = object()    # queued after the records to save
+
+
+def encode_block(values, transform=None):
+    """values: 2D float64 array (rows, columns); returns the bytes of the transformed block, column major"""
+    bits = np.ascontiguousarray(values.T, dtype="<f8").view("<u8")
+    if transform in ("delta", "delta+shuffle"):
+        bits = np.diff(bits, axis=1, prepend=np.zeros((bits.shape[0], 1), dtype="<u8"))
+    if transform in ("shuffle", "delta+shuffle"):
+        return np.ascontiguousarray(bits.view(np.uint8).reshape(bits.shape[0], bits.shape[1], 8).transpose(0, 2, 1)).tobytes()
+    return bits.tobytes()
+
+def decode_block(raw, rows, columns, transform=None):
+    """inverse of encode_block; returns a 2D float64 array (rows, columns)"""
+    if transform in ("shuffle", "delta+shuffle"):
+        planes = np.frombuffer(raw, dtype=np.uint8).reshape(columns, 8, rows)
+        bits = np.ascontiguousarray(planes.transpose(0, 2, 1)).view("<u8").reshape(columns, rows)
+    else:
+        bits = np.frombuffer(raw, dtype="<u8").reshape(columns, rows)
+    if transform in ("delta", "delta+shuffle"):
+        bits = np.cumsum(bits, axis=1, dtype="<u8")
+    return bits.view("<f8").T
+
+
+class Logger(abstracts.LoggerBase):
+    """Implementing a Logger writing a compressed csv or binary stream from a background thread"""
+
+    # self.Variables:
+
+    # everything from the __init__ parameters
+    # file: the compressed output stream
+    # block: the records waiting to be handed to the writer thread
+    # lastSaved: when the records were last handed over to be saved
+    # queue, writer: hand-over queue and writer thread
+
+    def __init__(self, filename, var_order, var_titles, format_strings, codec="gzip", encoding="csv", transform=None, level=6, block_records=DEFAULT_BLOCK_RECORDS, save_interval=DEFAULT_SAVE_INTERVAL):
+                #(self, file path/name, ["var names"], {"names": "full titles"}, {"names": "format strings"}, "gzip" / "lzma" / "bz2", "csv" / "binary", transform for binary encoding, compression level, records per block, saving interval)
+        if codec not in EXTENSIONS:
+            raise ValueError("[elflab.dataloggers.compressedlogger] unknown codec \"{}\"".format(codec))
+        if encoding not in ("csv", "binary"):
+            raise ValueError("[elflab.dataloggers.compressedlogger] unknown encoding \"{}\"".format(encoding))
+        if transform not in TRANSFORMS:
+            raise ValueError("[elflab.dataloggers.compressedlogger] unknown transform \"{}\"".format(transform))
+        if (transform is not None) and (encoding != "binary"):
+            raise ValueError("[elflab.dataloggers.compressedlogger] transforms only apply to the binary encoding")
+        if not filename.lower().endswith(EXTENSIONS[codec]):
+            filename = filename + EXTENSIONS[codec]
+        print("        [Compressed Logger:] Data will be logged in the file:\n>>>>>>>>>>>>\"{}\"<<<<<<<<<<<<\n".format(filename))
+        # Save parameters
+        self.filename = filename
+        self.var_order = list(var_order)
+        self.var_titles = var_titles
+        self.format_strings = format_strings
+        self.codec = codec
+        self.encoding = encoding
+        self.transform = transform
+        self.level = level
+        self.block_records = block_records
+        self.save_interval = save_interval
+
+    def _open(self, mode):
+        kwargs = {"mode": mode}
+        if self.encoding == "csv":
+            kwargs["newline"] = ''
+        if self.codec == "lzma":
+            kwargs["preset"] = self.level
+        else:
+            kwargs["compresslevel"] = self.level
+        self.file = datasets.COMPRESSED_OPENERS[EXTENSIONS[self.codec]](self.filename, **kwargs)
+        if self.encoding == "csv":
+            self.csvwriter = csv.writer(self.file)
+
+    def start(self):
+        # csv appends like the csvlogger; a binary stream carries a single header, so never appends
+        self._open("at" if self.encoding == "csv" else "xb")
+
+        # Header: a title row for csv, a json description for binary
+        if self.encoding == "csv":
+            self.csvwriter.writerow([self.var_titles[varName] for varName in self.var_order])
+        else:
+            header = json.dumps({"var_order": self.var_order,
+                                 "var_titles": {key: self.var_titles[key] for key in self.var_order},
+                                 "transform": self.transform
+                                }).encode("utf-8")
+            self.file.write(MAGIC + _UINT32.pack(len(header)) + header)
+
+        self.block = []
+        self.lastSaved = time.perf_counter()
+        self.error = None
+        self.queue = queue.Queue()
+        self.writer = threading.Thread(target=self._write, name="Compressed Logger: writer")
+        self.writer.start()
+
+    # hand the records over to the writer when a block is full, and have them saved every save_interval
+    def _hand_over(self, full):
+        t = time.perf_counter()
+        due = (t - self.lastSaved) > self.save_interval
+        if (full or due) and (len(self.block) > 0):
+            self.queue.put(self.block)
+            self.block = []
+        if due:
+            self.queue.put(_SAVE)
+            self.lastSaved = t
+
+    def log(self, dataToLog):
+        self.block.append([dataToLog[varName] for varName in self.var_order])
+        self._hand_over(len(self.block) >= self.block_records)
+
+    def log_block(self, dataset):
+        """log every row of a dataset at once; a BlockDataSet with the same variables goes without copying"""
+        if len(self.block) > 0:
+            self.queue.put(self.block)
+            self.block = []
+        self.queue.put(datasets.as_block(dataset, self.var_order).T)
+        self._hand_over(False)
+
+    # make everything written so far readable from the file
+    def _save(self):
+        if self.codec == "gzip":
+            self.file.flush()
+        else:
+            self.file.close()
+            self._open("at" if self.encoding == "csv" else "ab")
+
+    def _write(self):
+        # the writer thread: format / encode and compress whatever arrives, until None
+        while True:
+            block = self.queue.get()
+            if block is None:
+                break
+            if self.error is not None:
+                continue
+            try:
+                if block is _SAVE:
+                    self._save()
+                elif self.encoding == "csv":
+                    formats = [self.format_strings[varName] for varName in self.var_order]
+                    self.csvwriter.writerows([[f.format(v) for (f, v) in zip(formats, row)] for row in block])
+                else:
+                    values = np.asarray(block, dtype=np.float64)
+                    self.file.write(_UINT32.pack(values.shape[0]) + encode_block(values, self.transform))
+            except Exception as err:
+                self.error = err
+                print("        [Compressed Logger:] ERROR: {}".format(err))
+
+    def finish(self):
+        if len(self.block) > 0:
+            self.queue.put(self.block)
+            self.block = []
+        self.queue.put(None)
+        self.writer.join()
+        self.file.close()
+        if self.error is not None:
+            raise self.error
+
+
+# Reading back
+def _open(filename):
+    opener = datasets.COMPRESSED_OPENERS.get(os.path.splitext(filename)[1].lower(), open)
+    return opener(filename, "rb")
+
+def _read_header(f, filename):
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError("[elflab.dataloggers.compressedlogger] \"{}\" is not a binary compressed log".format(filename))
+    (n,) = _UINT32.unpack(f.read(_UINT32.size))
+    return json.loads(f.read(n).decode("utf-8"))
+
+def iter_blocks(filename):
+    """iterate over a binary compressed log, yielding (header, 2D float64 array of a block of records)
+    a log cut off by a crash ends with its last complete block"""
+    with _open(filename) as f:
+        header = _read_header(f, filename)
+        columns = len(header["var_order"])
+        while True:
+            try:
+                raw = f.read(_UINT32.size)
+                if len(raw) < _UINT32.size:
+                    break
+                (rows,) = _UINT32.unpack(raw)
+                raw = f.read(rows * columns * 8)
+            except (EOFError, lzma.LZMAError, OSError):
+                # the codecs raise on a stream cut off mid-way
+                break
+            if len(raw) < rows * columns * 8:
+                break
+            yield (header, decode_block(raw, rows, columns, header["transform"]))
+
+def iter_chunks(filename, chunk_rows=datasets.DEFAULT_CHUNK_ROWS):
+    """iterate over a binary compressed log in DataSets of chunk_rows rows"""
+    def blocks():
+        for (header, values) in iter_blocks(filename):
+            data = datasets.DataSet([(key, values[:, j]) for (j, key) in enumerate(header["var_order"])])
+            data.titles = header["var_titles"]
+            yield data
+    return datasets.rechunk(blocks(), chunk_rows)
+
+def _copy_complete_lines(filename, out):
+    # copy the decompressed text of a log cut off mid-stream into the file out, up to its last complete line
+    with _open(filename) as f:
+        tail = b""
+        while True:
+            try:
+                data = f.read1(datasets.DEFAULT_CHUNK_SIZE)    # read() would drop what it decoded before the cut
+            except (EOFError, lzma.LZMAError, OSError):
+                return
+            if len(data) == 0:
+                out.write(tail)
+                return
+            data = tail + data
+            cut = data.rfind(b"\n") + 1
+            out.write(data[:cut])
+            tail = data[cut:]
+
+def load(filename, var_order=None):
+    """load a compressed log, of either encoding, into a DataSet
+    var_order is only needed for csv encoded logs without a readable header order: defaults to the header row order"""
+    with _open(filename) as f:
+        is_binary = (f.read(len(MAGIC)) == MAGIC)
+    if not is_binary:
+        with datasets.open_text(filename) as f:
+            titles = next(csv.reader(f))
+        if var_order is None:
+            var_order = titles
+        try:
+            return datasets.load_csv(filename, list(enumerate(var_order)))
+        except (EOFError, lzma.LZMAError, OSError):
+            # cut off by a crash: load the complete lines
+            (handle, path) = tempfile.mkstemp(suffix=".csv")
+            try:
+                with os.fdopen(handle, "wb") as out:
+                    _copy_complete_lines(filename, out)
+                return datasets.load_csv(path, list(enumerate(var_order)))
+            finally:
+                os.remove(path)
+
+    with _open(filename) as f:
+        header = _read_header(f, filename)
+    blocks = [values for (h, values) in iter_blocks(filename)]
+    var_order = header["var_order"]
+    values = np.concatenate(blocks) if blocks else np.empty((0, len(var_order)))
+    data = datasets.DataSet([(key, values[:, j].copy()) for (j, key) in enumerate(var_order)])
+    data.titles = header["var_titles"]
+    return data
@@ -41,14 +41,21 @@ class Logger(abstracts.LoggerBase):
         self.lastSaved = time.perf_counter()
         
         
-    def log(self, dataToLog):
-        row = [self.format_strings[varName].format(dataToLog[varName]) for varName in self.var_order]
+    def encoding_key(self):
+        return (Logger, tuple(self.var_order), tuple(self.format_strings[varName] for varName in self.var_order))
+        
+    def encode(self, dataToLog):
+        return [self.format_strings[varName].format(dataToLog[varName]) for varName in self.var_order]
+        
+    def write(self, row):
         self.csvwriter.writerow(row)
         t = time.perf_counter()
         if (t - self.lastSaved) > self.save_interval:
             self.lastSaved = t
             self.file.flush()
             
+    def log(self, dataToLog):
+        self.write(self.encode(dataToLog))
         
     def finish(self):
         self.file.close()
@@ -0,0 +1,143 @@
+""" A Logger feeding several loggers ("sinks") at once, e.g. a csv file, a binary file and an in-memory window
+    log() only queues the record. One background writer encodes each record once per kind of sink, then hands it
+    to every sink's own bounded queue, which is drained by that sink's thread, so a slow sink never holds up the others.
+
+    The encode / write protocol: a logger may split log(dataToLog) into write(encode(dataToLog)), and define
+    encoding_key(), a hashable value equal for loggers whose encode() outputs are interchangeable. Sinks with equal
+    encoding keys share a single encode() call, made in the fan-out writer; write() runs in the sink's own thread.
+    Any other LoggerBase is simply fed through its log().
+"""
+
+import time
+import threading
+import queue
+
+from elflab import abstracts
+
+# Constants
+DEFAULT_QUEUE_SIZE = 100000     # records waiting per sink before new records are dropped for that sink
+
+
+class Sink:
+    """Bookkeeping for a single sink of the fan-out logger"""
+    def __init__(self, name, logger, queue_size):
+        self.name = name
+        self.logger = logger
+        self.queue = queue.Queue(maxsize=queue_size)
+        if hasattr(logger, "encoding_key") and hasattr(logger, "encode") and hasattr(logger, "write"):
+            self.key = logger.encoding_key()
+            self.encode = logger.encode
+            self.write = logger.write
+        else:
+            self.key = ("log", id(logger))
+            self.encode = lambda dataToLog: dataToLog
+            self.write = logger.log
+        # statistics
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+        self.max_backlog = 0
+        self.busy_time = 0.
+
+    def drain(self):
+        # the sink's own thread: write whatever arrives, until None
+        while True:
+            encoded = self.queue.get()
+            if encoded is None:
+                break
+            t0 = time.perf_counter()
+            try:
+                self.write(encoded)
+                self.written += 1
+            except Exception as err:
+                if self.errors == 0:
+                    print("        [Fan-out Logger:] ERROR in sink \"{}\": {}".format(self.name, err))
+                self.errors += 1
+            self.busy_time += time.perf_counter() - t0
+
+    def stats(self):
+        return {"written": self.written,
+                "dropped": self.dropped,
+                "errors": self.errors,
+                "backlog": self.queue.qsize(),
+                "max_backlog": self.max_backlog,
+                "busy_time": self.busy_time
+               }
+
+
+class Logger(abstracts.LoggerBase):
+    """Implementing a Logger that fans every record out to several loggers"""
+
+    # self.Variables:
+
+    # sinks: [Sink]
+    # groups: [(encode function, [Sink])], one group per encoding key
+    # queue, writer: the input queue and the background writer
+
+    def __init__(self, sinks, queue_size=DEFAULT_QUEUE_SIZE):
+                #(self, [loggers] or {"name": logger}, maximum backlog per sink)
+        if isinstance(sinks, dict):
+            named = sorted(sinks.items())
+        else:
+            named = [("{}:{}".format(i, type(logger).__module__.split(".")[-1]), logger) for (i, logger) in enumerate(sinks)]
+        print("        [Fan-out Logger:] Data will be logged by: {}\n".format(", ".join(name for (name, logger) in named)))
+        self.sinks = [Sink(name, logger, queue_size) for (name, logger) in named]
+        self.groups = []
+        keys = []
+        for sink in self.sinks:
+            if sink.key in keys:
+                self.groups[keys.index(sink.key)][1].append(sink)
+            else:
+                keys.append(sink.key)
+                self.groups.append((sink.encode, [sink]))
+
+    def start(self):
+        for sink in self.sinks:
+            sink.logger.start()
+            sink.thread = threading.Thread(target=sink.drain, name="Fan-out Logger: {}".format(sink.name))
+            sink.thread.start()
+        self.queue = queue.Queue()
+        self.writer = threading.Thread(target=self._dispatch, name="Fan-out Logger: writer")
+        self.writer.start()
+
+    def log(self, dataToLog):
+        self.queue.put(dict(dataToLog))     # the caller may reuse its dict
+
+    def _dispatch(self):
+        # the background writer: encode once per group, then queue for every sink of the group
+        while True:
+            dataToLog = self.queue.get()
+            if dataToLog is None:
+                break
+            for (encode, sinks) in self.groups:
+                try:
+                    encoded = encode(dataToLog)
+                except Exception as err:
+                    for sink in sinks:
+                        if sink.errors == 0:
+                            print("        [Fan-out Logger:] ERROR encoding for sink \"{}\": {}".format(sink.name, err))
+                        sink.errors += 1
+                    continue
+                for sink in sinks:
+                    try:
+                        sink.queue.put_nowait(encoded)
+                    except queue.Full:
+                        if sink.dropped == 0:
+                            print("        [Fan-out Logger:] WARNING: sink \"{}\" is falling behind, dropping records".format(sink.name))
+                        sink.dropped += 1
+                    backlog = sink.queue.qsize()
+                    if backlog > sink.max_backlog:
+                        sink.max_backlog = backlog
+
+    def stats(self):
+        """per-sink statistics: {"name": {"written", "dropped", "errors", "backlog", "max_backlog", "busy_time"}}"""
+        return {sink.name: sink.stats() for sink in self.sinks}
+
+    def finish(self):
+        self.queue.put(None)
+        self.writer.join()
+        for sink in self.sinks:
+            sink.queue.put(None)
+        for sink in self.sinks:
+            sink.thread.join()
+            sink.logger.finish()
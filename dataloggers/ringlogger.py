@@ -0,0 +1,119 @@
+""" An in-memory Logger keeping the last N records in a preallocated ring buffer, for controllers and UIs needing
+    recent history (rates of change, settling checks) without querying the instruments again.
+
+    Every record is written twice, at slot i and i + N of a buffer of 2N columns, so that any window of up to N
+    most recent records is a single contiguous slice: last(n) and since(t) return DataSets of zero-copy views.
+    A view of n records stays valid for the next N - n records logged, so by default only windows of up to N // 2
+    records are views (valid for at least N // 2 more records), and longer ones are copied; copy=True or False forces either.
+"""
+
+import threading
+
+import numpy as np
+
+from elflab import abstracts
+import elflab.datasets as datasets
+
+# Constants
+DEFAULT_CAPACITY = 10000
+DEFAULT_TIME_KEY = "t"
+
+
+class Logger(abstracts.LoggerBase):
+    """Implementing a Logger keeping recent history in memory"""
+
+    # self.Variables:
+
+    # everything from the __init__ parameters
+    # buffer: 2D array (variables, 2 * capacity), each variable contiguous
+    # count: total number of records logged
+    # lock: guards buffer and count
+
+    def __init__(self, var_order, capacity=DEFAULT_CAPACITY, time_key=DEFAULT_TIME_KEY, var_titles=None):
+                #(self, ["var names"], number of records to keep, name of the time variable, {"names": "full titles"})
+        self.var_order = list(var_order)
+        self.capacity = int(capacity)
+        self.time_key = time_key
+        self.var_titles = {key: key for key in self.var_order} if var_titles is None else var_titles
+        self.columns = {key: j for (j, key) in enumerate(self.var_order)}
+        self.buffer = np.full((len(self.var_order), 2 * self.capacity), np.nan)
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def start(self):
+        pass
+
+    def encoding_key(self):
+        return (Logger, tuple(self.var_order))
+
+    def encode(self, dataToLog):
+        return np.array([dataToLog[varName] for varName in self.var_order], dtype=np.float64)
+
+    def write(self, row):
+        with self.lock:
+            i = self.count % self.capacity
+            self.buffer[:, i] = row
+            self.buffer[:, i + self.capacity] = row
+            self.count += 1
+
+    def log(self, dataToLog):
+        self.write(self.encode(dataToLog))
+
+    def finish(self):
+        pass
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def _window(self, n):
+        # (start, stop) of the n most recent records in the buffer; call with the lock held
+        n = min(n, self.count, self.capacity)
+        stop = (self.count - 1) % self.capacity + self.capacity + 1 if self.count > 0 else self.capacity
+        return (stop - n, stop)
+
+    def _dataset(self, start, stop, copy):
+        block = self.buffer[:, start:stop]
+        if copy is None:
+            copy = (stop - start) > self.capacity // 2
+        if copy:
+            block = block.copy()
+        data = datasets.DataSet([(key, block[j]) for (j, key) in enumerate(self.var_order)])
+        data.titles = {key: self.var_titles[key] for key in self.var_order}
+        return data
+
+    def last(self, n=None, copy=None):
+        """the n most recent records (all the records kept if n is None) as a DataSet, oldest first
+        copy: None to copy only windows longer than capacity // 2, see above"""
+        with self.lock:
+            (start, stop) = self._window(self.capacity if n is None else n)
+            return self._dataset(start, stop, copy)
+
+    def since(self, t, copy=None):
+        """the records with time >= t as a DataSet, assuming the time variable increases; copy as in last()"""
+        with self.lock:
+            (start, stop) = self._window(self.capacity)
+            start += int(np.searchsorted(self.buffer[self.columns[self.time_key], start:stop], t, side="left"))
+            return self._dataset(start, stop, copy)
+
+    def latest(self):
+        """the most recent record as {"name": value}, or None if nothing is logged yet"""
+        with self.lock:
+            if self.count == 0:
+                return None
+            (start, stop) = self._window(1)
+            return {key: float(self.buffer[j, start]) for (j, key) in enumerate(self.var_order)}
+
+    def rate(self, key, n):
+        """d(key)/d(time) over the n most recent records, by a least-squares straight line"""
+        with self.lock:
+            (start, stop) = self._window(n)
+            t = self.buffer[self.columns[self.time_key], start:stop]
+            v = self.buffer[self.columns[key], start:stop]
+            ok = np.isfinite(t) & np.isfinite(v)
+            if np.count_nonzero(ok) < 2:
+                return np.nan
+            t = t[ok] - t[ok].mean()
+            tt = np.dot(t, t)
+            if tt == 0.:
+                return np.nan
+            return float(np.dot(t, v[ok] - v[ok].mean()) / tt)
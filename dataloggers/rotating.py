@@ -0,0 +1,191 @@
+""" A CSV logger that rotates into numbered segments by size and / or time,
+    keeping a small sidecar index of the time range, row count and per-column min / max of each segment,
+    so that a partial read only opens the segments overlapping the requested window.
+
+    For filename "run.dat", segments are "run.0000.dat", "run.0001.dat", ... and the index is "run.dat.index.json"
+"""
+
+import os
+import json
+import time
+
+import numpy as np
+
+import elflab.datasets as datasets
+from elflab.dataloggers import csvlogger
+
+# Constants
+DEFAULT_TIME_KEY = "t"
+INDEX_SUFFIX = ".index.json"
+
+
+def segment_name(filename, number):
+    (root, ext) = os.path.splitext(filename)
+    return "{}.{:04d}{}".format(root, number, ext)
+
+def load_index(filename):
+    with open(filename + INDEX_SUFFIX, "r") as f:
+        return json.load(f)
+
+def scan_segment(path, var_order):
+    """the row count and per-column min / max of a segment file, as in its index entry"""
+    stats = {"rows": 0, "min": {key: None for key in var_order}, "max": {key: None for key in var_order}}
+    if not os.path.exists(path):
+        return stats
+    data = datasets.load_csv(path, list(enumerate(var_order)))
+    stats["rows"] = data.length
+    for key in var_order:
+        finite = data[key][~np.isnan(data[key])]
+        if finite.shape[0] > 0:
+            stats["min"][key] = float(finite.min())
+            stats["max"][key] = float(finite.max())
+    return stats
+
+
+class Logger(csvlogger.Logger):
+    """Implementing a CSV Logger rotating into numbered segments, with a sidecar index"""
+
+    # self.Variables:
+
+    # everything from the __init__ parameters
+    # base_filename: the filename as given, self.filename is the current segment
+    # index: the content of the sidecar index
+    # current: the index entry of the current segment
+
+    def __init__(self, filename, var_order, var_titles, format_strings, rotate_size=None, rotate_interval=None, time_key=DEFAULT_TIME_KEY, save_interval=csvlogger.DEFAULT_SAVE_INTERVAL, openKwargs={}, csvKwargs={}):
+                #(self, file path/name, ["var names"], {"names": "full titles"}, {"names": "format strings"}, rotate after this many bytes, rotate after this many seconds, name of the time variable, ...as csvlogger)
+        super(Logger, self).__init__(filename, var_order, var_titles, format_strings, save_interval=save_interval, openKwargs=openKwargs, csvKwargs=csvKwargs)
+        print("        [CSV Logger:] Rotating into segments every {} bytes / {} s, indexed in:\n>>>>>>>>>>>>\"{}\"<<<<<<<<<<<<\n".format(rotate_size, rotate_interval, filename + INDEX_SUFFIX))
+        self.base_filename = filename
+        self.rotate_size = rotate_size
+        self.rotate_interval = rotate_interval
+        self.time_key = time_key
+
+    def start(self):
+        # Continue an existing run if there's already an index; the entry of its last segment may be stale after a crash
+        if os.path.exists(self.base_filename + INDEX_SUFFIX):
+            self.index = load_index(self.base_filename)
+            if len(self.index["segments"]) > 0:
+                last = self.index["segments"][-1]
+                path = os.path.join(os.path.dirname(self.base_filename), last["file"])
+                last.update(scan_segment(path, self.index["var_order"]))
+        else:
+            self.index = {"var_order": list(self.var_order),
+                          "var_titles": {key: self.var_titles[key] for key in self.var_order},
+                          "time_key": self.time_key,
+                          "segments": []
+                         }
+        self._open_segment()
+
+    def _open_segment(self):
+        number = len(self.index["segments"])
+        self.filename = segment_name(self.base_filename, number)
+        self.current = {"file": os.path.basename(self.filename),
+                        "rows": 0,
+                        "min": {key: None for key in self.var_order},
+                        "max": {key: None for key in self.var_order}
+                       }
+        self.index["segments"].append(self.current)
+        self.size = 0
+        self.opened = time.perf_counter()
+        super(Logger, self).start()
+        self._save_index()
+
+    def _save_index(self):
+        # Write to a temporary file first, so that the index is never left half-written
+        path = self.base_filename + INDEX_SUFFIX
+        with open(path + ".tmp", "w") as f:
+            json.dump(self.index, f, indent=1)
+        os.replace(path + ".tmp", path)
+
+    # the statistics need the values as well as the formatted row
+    def encoding_key(self):
+        return (Logger,) + super(Logger, self).encoding_key()[1:]
+
+    def encode(self, dataToLog):
+        return (super(Logger, self).encode(dataToLog), [float(dataToLog[varName]) for varName in self.var_order])
+
+    def write(self, encoded):
+        (row, values) = encoded
+        self.csvwriter.writerow(row)
+        self.size += sum(len(s) for s in row) + len(row) + 1
+
+        # update the statistics of the segment
+        self.current["rows"] += 1
+        mins = self.current["min"]
+        maxs = self.current["max"]
+        for (varName, v) in zip(self.var_order, values):
+            if v == v:  # skip NaN's
+                if (mins[varName] is None) or (v < mins[varName]):
+                    mins[varName] = v
+                if (maxs[varName] is None) or (v > maxs[varName]):
+                    maxs[varName] = v
+
+        t = time.perf_counter()
+        if ((self.rotate_size is not None) and (self.size >= self.rotate_size)) or ((self.rotate_interval is not None) and (t - self.opened >= self.rotate_interval)):
+            self.file.close()
+            self._open_segment()
+        elif (t - self.lastSaved) > self.save_interval:
+            self.lastSaved = t
+            self.file.flush()
+            self._save_index()
+
+    def finish(self):
+        self.file.close()
+        self._save_index()
+
+
+def overlapping_segments(filename, ranges):
+    """return the paths of the segments that may contain rows within ranges = {"var name": (min, max)}
+    None in place of min or max means unbounded
+    the last segment is always included: its index entry is behind while it is written, or after a crash"""
+    index = load_index(filename)
+    folder = os.path.dirname(filename)
+    paths = []
+    for (i, seg) in enumerate(index["segments"]):
+        if i == len(index["segments"]) - 1:
+            if os.path.exists(os.path.join(folder, seg["file"])):
+                paths.append(os.path.join(folder, seg["file"]))
+            continue
+        if seg["rows"] == 0:
+            continue
+        overlaps = True
+        for (key, (lo, hi)) in ranges.items():
+            mn = seg["min"][key]
+            mx = seg["max"][key]
+            if (mn is None) or ((hi is not None) and (mn > hi)) or ((lo is not None) and (mx < lo)):
+                overlaps = False
+                break
+        if overlaps:
+            paths.append(os.path.join(folder, seg["file"]))
+    return paths
+
+def load(filename, t_range=None, ranges=None, **csv_params):
+    """load the rows of a rotated log within the time window t_range = (t_min, t_max)
+    and / or other windows, ranges = {"var name": (min, max)}; only the overlapping segments are read"""
+    index = load_index(filename)
+    ranges = {} if ranges is None else dict(ranges)
+    if t_range is not None:
+        ranges[index["time_key"]] = t_range
+    indices = list(enumerate(index["var_order"]))
+
+    pieces = []
+    for path in overlapping_segments(filename, ranges):
+        data = datasets.load_csv(path, indices, **csv_params)
+        # trim to the requested window
+        mask = np.ones(data.length, dtype=bool)
+        for (key, (lo, hi)) in ranges.items():
+            if lo is not None:
+                mask &= (data[key] >= lo)
+            if hi is not None:
+                mask &= (data[key] <= hi)
+        if not mask.all():
+            data = datasets.DataSet([(key, data[key][mask]) for key in data])
+        pieces.append(data)
+
+    if len(pieces) == 0:
+        result = datasets.DataSet([(key, np.empty((0,), dtype=np.float64)) for (i, key) in indices])
+    else:
+        result = datasets.concatenate(pieces)
+    result.titles = {key: index["var_titles"][key] for (i, key) in indices}
+    return result
@@ -0,0 +1,246 @@
+""" A crash-safe logger: data are written into fixed-size binary segments with a checksum on every record.
+    A power failure can at most lose the records written since the last fsync; a half-written record is detected by its checksum
+    and dropped by recover(), which rebuilds a clean dataset from whatever segments survived.
+
+    Segment file layout ("{filename}.{segment number:06d}.seg"):
+        MAGIC | uint32 header length | JSON header | uint32 crc32(header) | record slots ...
+    Each record slot:
+        uint32 slot number + 1 | float64 value for each variable in var_order | uint32 crc32(of the preceding bytes)
+    Segments are preallocated to their full size, so an unwritten slot reads as zeros and fails its checksum.
+"""
+
+import os
+import sys
+import csv
+import glob
+import json
+import time
+import struct
+import zlib
+
+import numpy as np
+
+from elflab import abstracts
+import elflab.datasets as datasets
+
+# Constants
+MAGIC = b"ELFSEG01"
+SEGMENT_SUFFIX = ".seg"
+DEFAULT_SEGMENT_RECORDS = 65536     # records per segment
+DEFAULT_FSYNC_RECORDS = 100     # fsync after this many records...
+DEFAULT_FSYNC_INTERVAL = 1.     # ...or after this many seconds, whichever comes first
+
+_UINT32 = struct.Struct("<I")
+
+
+def segment_name(filename, number):
+    return "{}.{:06d}{}".format(filename, number, SEGMENT_SUFFIX)
+
+def list_segments(filename):
+    """return the paths of all segments belonging to filename, in order"""
+    pattern = glob.escape(filename) if hasattr(glob, "escape") else filename
+    return sorted(glob.glob(pattern + ".[0-9][0-9][0-9][0-9][0-9][0-9]" + SEGMENT_SUFFIX))
+
+def _fsync(fileobj):
+    fileobj.flush()
+    if hasattr(os, "fdatasync"):
+        os.fdatasync(fileobj.fileno())
+    else:
+        os.fsync(fileobj.fileno())
+
+def _fsync_dir(path):
+    # make a newly created file entry durable; not supported on every platform
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class Logger(abstracts.LoggerBase):
+    """Implementing a Logger writing checksummed binary segments with a bounded fsync policy"""
+
+    # self.Variables:
+
+    # everything from the __init__ parameters
+    # file: the currently open segment
+    # segment: number of the current segment
+    # slot: number of records already written to the current segment
+
+    def __init__(self, filename, var_order, var_titles, format_strings, segment_records=DEFAULT_SEGMENT_RECORDS, fsync_records=DEFAULT_FSYNC_RECORDS, fsync_interval=DEFAULT_FSYNC_INTERVAL):
+                #(self, base file path/name, ["var names"], {"names": "full titles"}, {"names": "format strings"}, records per segment, fsync every n records, fsync every t seconds)
+        print("        [WAL Logger:] Data will be logged in the segments:\n>>>>>>>>>>>>\"{}\"<<<<<<<<<<<<\n".format(filename + ".*" + SEGMENT_SUFFIX))
+        # Save parameters
+        self.filename = filename
+        self.var_order = list(var_order)
+        self.var_titles = var_titles
+        self.format_strings = format_strings
+        self.segment_records = int(segment_records)
+        self.fsync_records = int(fsync_records)
+        self.fsync_interval = fsync_interval
+
+        n = len(self.var_order)
+        self.values = struct.Struct("<{}d".format(n))
+        self.record_size = _UINT32.size + self.values.size + _UINT32.size
+        self.header = json.dumps({"var_order": self.var_order,
+                                  "var_titles": {key: var_titles[key] for key in self.var_order},
+                                  "format_strings": {key: format_strings[key] for key in self.var_order},
+                                  "segment_records": self.segment_records
+                                 }).encode("utf-8")
+        self.file = None
+
+    def start(self):
+        # Never overwrite an earlier run: continue numbering after the existing segments
+        existing = list_segments(self.filename)
+        if existing:
+            self.segment = int(existing[-1][-len(SEGMENT_SUFFIX)-6:-len(SEGMENT_SUFFIX)])
+        else:
+            self.segment = -1
+        self._new_segment()
+        self.unsynced = 0
+        self.lastSaved = time.perf_counter()
+
+    def _new_segment(self):
+        if self.file is not None:
+            _fsync(self.file)
+            self.file.close()
+        self.segment += 1
+        self.slot = 0
+        path = segment_name(self.filename, self.segment)
+        self.file = open(path, mode="xb")
+        prefix = MAGIC + _UINT32.pack(len(self.header)) + self.header
+        self.file.write(prefix + _UINT32.pack(zlib.crc32(prefix) & 0xffffffff))
+        self.data_offset = self.file.tell()
+        # preallocate the whole segment
+        self.file.truncate(self.data_offset + self.segment_records * self.record_size)
+        _fsync(self.file)
+        _fsync_dir(path)
+
+    def encoding_key(self):
+        return (Logger, tuple(self.var_order))
+
+    def encode(self, dataToLog):
+        return self.values.pack(*[float(dataToLog[varName]) for varName in self.var_order])
+
+    def write(self, payload):
+        if self.slot >= self.segment_records:
+            self._new_segment()
+        prefix = _UINT32.pack(self.slot + 1)
+        self.file.write(prefix + payload + _UINT32.pack(zlib.crc32(payload, zlib.crc32(prefix)) & 0xffffffff))
+        self.slot += 1
+        self.unsynced += 1
+        t = time.perf_counter()
+        if (self.unsynced >= self.fsync_records) or ((t - self.lastSaved) > self.fsync_interval):
+            _fsync(self.file)
+            self.unsynced = 0
+            self.lastSaved = t
+
+    def log(self, dataToLog):
+        self.write(self.encode(dataToLog))
+
+    def finish(self):
+        _fsync(self.file)
+        self.file.close()
+        self.file = None
+
+
+# Reading segments back
+def read_segment(path):
+    """read one segment, returning (header, values) with values a 2D numpy array of the valid records
+    records failing their checksum (torn writes, unwritten slots) are dropped"""
+    with open(path, "rb") as f:
+        raw = f.read()
+    if raw[:len(MAGIC)] != MAGIC:
+        raise ValueError("[elflab.dataloggers.walogger.read_segment] \"{}\" is not a data segment".format(path))
+    i = len(MAGIC)
+    (header_length,) = _UINT32.unpack_from(raw, i)
+    i += _UINT32.size + header_length
+    (crc,) = _UINT32.unpack_from(raw, i)
+    if zlib.crc32(raw[:i]) & 0xffffffff != crc:
+        raise ValueError("[elflab.dataloggers.walogger.read_segment] corrupted header in \"{}\"".format(path))
+    header = json.loads(raw[len(MAGIC)+_UINT32.size:i].decode("utf-8"))
+    i += _UINT32.size
+
+    n = len(header["var_order"])
+    record_dtype = np.dtype([("slot", "<u4"), ("values", "<f8", (n,)), ("crc", "<u4")])
+    count = (len(raw) - i) // record_dtype.itemsize
+    records = np.frombuffer(raw, dtype=record_dtype, count=count, offset=i)
+    # cheap vectorised pre-selection, then verify the checksums of the candidates
+    candidates = np.nonzero(records["slot"] == np.arange(1, count+1, dtype=np.uint32))[0]
+    size = record_dtype.itemsize - _UINT32.size
+    valid = [j for j in candidates
+                if zlib.crc32(raw[i + j*record_dtype.itemsize : i + j*record_dtype.itemsize + size]) & 0xffffffff == records["crc"][j]]
+    return (header, records["values"][valid])
+
+def _recover(filename):
+    # returns (header of the first readable segment, 2D array of all the surviving records)
+    first = None
+    blocks = []
+    for path in list_segments(filename):
+        try:
+            header, values = read_segment(path)
+        except (ValueError, struct.error) as err:
+            print("        [WAL Logger:] WARNING: skipping segment \"{}\": {}".format(path, err))
+            continue
+        if first is None:
+            first = header
+        elif header["var_order"] != first["var_order"]:
+            print("        [WAL Logger:] WARNING: skipping segment \"{}\": variables do not match".format(path))
+            continue
+        blocks.append(values)
+    if first is None:
+        raise IOError("[elflab.dataloggers.walogger.recover] no readable segments found for \"{}\"".format(filename))
+    return (first, np.concatenate(blocks))
+
+def recover(filename):
+    """rebuild a DataSet from all the surviving segments of a run"""
+    header, values = _recover(filename)
+    data = datasets.DataSet([(key, values[:, j].copy()) for (j, key) in enumerate(header["var_order"])])
+    data.titles = header["var_titles"]
+    return data
+
+def iter_chunks(filename, chunk_rows=datasets.DEFAULT_CHUNK_ROWS):
+    """iterate over the surviving records of a run in DataSets of chunk_rows rows, one segment in memory at a time"""
+    def segments():
+        var_order = None
+        for path in list_segments(filename):
+            try:
+                header, values = read_segment(path)
+            except (ValueError, struct.error) as err:
+                print("        [WAL Logger:] WARNING: skipping segment \"{}\": {}".format(path, err))
+                continue
+            if var_order is None:
+                var_order = header["var_order"]
+            elif header["var_order"] != var_order:
+                print("        [WAL Logger:] WARNING: skipping segment \"{}\": variables do not match".format(path))
+                continue
+            data = datasets.DataSet([(key, values[:, j]) for (j, key) in enumerate(var_order)])
+            data.titles = header["var_titles"]
+            yield data
+    return datasets.rechunk(segments(), chunk_rows)
+
+def recover_csv(filename, csv_path):
+    """rebuild a clean csv file, in the same layout as the csvlogger, from the surviving segments
+    returns the number of records recovered"""
+    header, values = _recover(filename)
+    var_order = header["var_order"]
+    with open(csv_path, mode="wt", newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow([header["var_titles"][varName] for varName in var_order])
+        for row in values:
+            writer.writerow([header["format_strings"][varName].format(v) for (varName, v) in zip(var_order, row)])
+    return values.shape[0]
+
+
+if __name__ == '__main__':
+    # usage: python walogger.py base_filename output.csv
+    if len(sys.argv) != 3:
+        print("usage: python -m elflab.dataloggers.walogger base_filename output.csv")
+        sys.exit(1)
+    n = recover_csv(sys.argv[1], sys.argv[2])
+    print("        [WAL Logger:] {} records recovered into \"{}\"".format(n, sys.argv[2]))
@@ -2,7 +2,15 @@
 # Defines the DataSet class and various creation / manipulation methods
 ######################################################################################################
 
+import os
+import re
 import csv
+import json
+import string
+import warnings
+import gzip
+import bz2
+import lzma
 
 import elflab.abstracts as abstracts
 import elflab.errors as errors
@@ -14,6 +22,8 @@ class DataSet(abstracts.DataSetBase):
     def __init__(self, *args, **kwargs):
         super(DataSet, self).__init__(*args, **kwargs)
         self.sorted_views = {}
+        self._versions = {}
+        self._interpolators = {}
         if len(self) > 0:
             self.length = -1
             for key in self:
@@ -28,9 +38,9 @@ class DataSet(abstracts.DataSetBase):
         
     # Create an empty dataset with identical variables
     def empty(self):
-        new_set = DataSet([(key, np.empty((0,), dtype=np.float)) for key in self])
+        new_set = DataSet([(key, np.empty((0,), dtype=np.float64)) for key in self])
         if self.errors is not None:
-            new_set.errors = {key:np.empty((0,), dtype=np.float) for key in self}
+            new_set.errors = {key:np.empty((0,), dtype=np.float64) for key in self}
         new_set.titles = self.titles.copy()
         new_set.length = 0
         return new_set
@@ -39,77 +49,765 @@ class DataSet(abstracts.DataSetBase):
     def duplicate(self):
         new_set = DataSet([(key,self[key].copy()) for key in self])
         if self.errors is not None:
-            newset.errors = {key: self.errors[key].copy() for key in self}
+            new_set.errors = {key: self.errors[key].copy() for key in self}
         new_set.titles = self.titles.copy()
         return new_set
         
-    # return a sorted copy
+    # return a dataset of the rows start:stop, sharing memory with this one
+    def slice(self, start, stop):
+        new_set = DataSet([(key, self[key][start:stop]) for key in self])
+        if self.errors is not None:
+            new_set.errors = {key: self.errors[key][start:stop] for key in self}
+        new_set.titles = self.titles
+        return new_set
+        
+    # return a dataset of the rows selected by an index array or a boolean mask, copied
+    def take(self, rows):
+        new_set = DataSet([(key, self[key][rows]) for key in self])
+        if self.errors is not None:
+            new_set.errors = {key: self.errors[key][rows] for key in self}
+        new_set.titles = self.titles.copy()
+        return new_set
+        
+    # pickled (e.g. for a process pool) as plain columns, errors and titles: views are gathered, caches left out
+    def __reduce__(self):
+        return (_rebuild, (list(self.items()), None if self.errors is None else dict(self.errors.items()), self.titles))
+        
+    # Assigning a column marks it as changed, so that cached sorted views are rebuilt
+    def __setitem__(self, key, value):
+        super(DataSet, self).__setitem__(key, value)
+        self._versions[key] = self._versions.get(key, 0) + 1
+        self.length = np.shape(value)[0]
+        
+    # Mark a column as changed after modifying it in place, e.g. data["R"][i] = ...
+    def touch(self, key):
+        self._versions[key] = self._versions.get(key, 0) + 1
+        
+    def version(self, key):
+        return self._versions.get(key, 0)
+        
+    # return a view sorted by key: only the sorting permutation is stored, columns are gathered when accessed
     def sort(self, key):
-        # compute sorted indices
-        if key in self.sorted_views:
-            sorted = self.sorted_views[key]
-        else:
-            indices = np.argsort(self[key], kind='quicksort')
-            sorted = DataSet([(k,self[k][indices]) for k in self])
-            if self.errors is not None:
-                sorted.errors = {k:self.errors[k][indices] for k in self}
-            self.sorted_views[key] = sorted
-            sorted.sorted_views = self.sorted_views
-            sorted.titles = self.titles
-        return sorted
-        
-    # return an interpolator: interpolate y from x
-    def interpolator(self, x, y, order=1):
+        view = self.sorted_views.get(key)
+        if (view is None) or not view.is_current():
+            view = SortedView(self, key, np.argsort(self[key], kind='quicksort'))
+            self.sorted_views[key] = view
+        return view
+        
+    # return the rows where mask is True, as a RowView
+    def where(self, mask):
+        return self._view(np.flatnonzero(mask))
+        
+    # return the rows satisfying condition (a Condition, a function of the dataset or a boolean array), as a view
+    # the rows keep their order, or come sorted by the variable of the narrowest Range if by_key
+    def query(self, condition, by_key=False):
+        if not isinstance(condition, Condition):
+            if not callable(condition):
+                return self.where(condition)
+            condition = Condition(condition)
+        conditions = condition.conditions if isinstance(condition, All) else [condition]
+        ranges = [c for c in conditions if isinstance(c, Range)]
+        if len(ranges) == 0:
+            return self.where(condition.mask(self))
+        # the narrowest range picks the candidate rows; only the first one is sorted if none is sorted already
+        cached = [c for c in ranges if (c.key in self.sorted_views) and self.sorted_views[c.key].is_current()]
+        best = None
+        for c in (cached if len(cached) > 0 else ranges[:1]):
+            sorted = self.sort(c.key)
+            (start, stop) = c.bounds(sorted[c.key])
+            if (best is None) or (stop - start < best[2] - best[1]):
+                best = (c, start, stop, sorted.indices)
+        (c, start, stop, permutation) = best
+        rows = permutation[start:stop]
+        if not by_key:
+            rows = np.sort(rows)
+        rest = [other for other in conditions if other is not c]
+        if len(rest) > 0:
+            rows = rows[All(rest).mask(RowView(self, rows))]
+        return self._view(rows)
+        
+    # return the rows where lo <= self[key] <= hi, as a view
+    def between(self, key, lo=None, hi=None):
+        return self.query(Range(key, lo, hi))
+        
+    # contiguous rows are a plain slice, other rows a RowView
+    def _view(self, rows):
+        n = rows.shape[0]
+        if (n > 0) and (rows[-1] - rows[0] + 1 == n) and (np.diff(rows) == 1).all():
+            return self.slice(int(rows[0]), int(rows[-1]) + 1)
+        return RowView(self, rows)
+        
+    # return an interpolator: interpolate y (or the errors of y) from x
+    # interpolators are cached until either column changes, or the errors of y are assigned; order=1 uses np.interp
+    def interpolator(self, x, y, order=1, errors=False):
+        cache_key = (x, y, order, errors)
+        state = (self.version(x), self.version(y), self.errors, self.errors[y] if errors else None)
+        cached = self._interpolators.get(cache_key)
+        if ((cached is not None) and (cached[0][:2] == state[:2])
+                and (cached[0][2] is state[2]) and (cached[0][3] is state[3])):
+            return cached[1]
         # sort according to the argument
         sorted = self.sort(x)
+        xs = sorted[x]
+        ys = sorted.errors[y] if errors else sorted[y]
+        valid = np.isfinite(xs) & np.isfinite(ys)
+        if not valid.all():
+            xs = xs[valid]
+            ys = ys[valid]
+        if order == 1:
+            f = LinearInterpolator(xs, ys)
+        else:
+            f = interpolate.UnivariateSpline(xs, ys, k=order, s=0)
+        self._interpolators[cache_key] = (state, f)
+        return f
+        
+def _rebuild(columns, errors, titles):
+    new_set = DataSet(columns)
+    new_set.errors = errors
+    new_set.titles = titles
+    return new_set
+    
+class LinearInterpolator:
+    """Piecewise linear interpolation through points sorted by x, evaluated with np.interp;
+    the end segments are extended linearly, as UnivariateSpline(x, y, k=1, s=0) does"""
+    def __init__(self, x, y):
+        if x.shape[0] < 2:
+            raise ValueError("[elflab.datasets.LinearInterpolator] at least two points are needed")
+        self.x = x
+        self.y = y
+        self.x0 = x[0]
+        self.x1 = x[-1]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            self.slope0 = (y[1] - y[0]) / (x[1] - x[0])
+            self.slope1 = (y[-1] - y[-2]) / (x[-1] - x[-2])
+        
+    def __call__(self, x):
+        x = np.asarray(x, dtype=np.float64)
+        return np.where(x < self.x0, self.y[0] + self.slope0 * (x - self.x0),
+                    np.where(x > self.x1, self.y[-1] + self.slope1 * (x - self.x1),
+                        np.interp(x, self.x, self.y)))
+        
+# Placeholder for a column not loaded yet
+_NOT_LOADED = object()
+
+class _LazyColumns:
+    """Mixin for dicts of columns produced on first access by self._loader(key)"""
+    def __getitem__(self, key):
+        value = super(_LazyColumns, self).__getitem__(key)
+        if (value is _NOT_LOADED) or self._stale(key):
+            value = self._loader(key)
+            dict.__setitem__(self, key, value)
+        return value
+        
+    # whether a loaded column has to be produced again
+    def _stale(self, key):
+        return False
+        
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+        
+    def values(self):
+        return [self[key] for key in self]
+        
+    def items(self):
+        return [(key, self[key]) for key in self]
+        
+    def is_loaded(self, key):
+        return super(_LazyColumns, self).__getitem__(key) is not _NOT_LOADED
+        
+    # Dict-level access must not see the placeholders: overriding __iter__ makes dict(view), {**view}, update()
+    # and DataSet(view) fall back to keys() and __getitem__; the rest of the dict methods that return values follow
+    def __iter__(self):
+        return dict.__iter__(self)
+        
+    def copy(self):
+        return dict(self.items())
+        
+    def pop(self, key, *default):
+        if key in self:
+            value = self[key]
+            dict.__delitem__(self, key)
+            return value
+        return dict.pop(self, key, *default)
+        
+    def popitem(self):
+        key = next(reversed(list(dict.keys(self))))
+        return (key, self.pop(key))
+        
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+        
+    def __repr__(self):
+        return "{}({})".format(type(self).__name__, repr(dict(self.items())))
+        
+class LazyDict(_LazyColumns, dict):
+    """{"key": column} with columns produced by loader(key) on first access, and again whenever stale(key)"""
+    def __init__(self, keys, loader, stale=None):
+        super(LazyDict, self).__init__([(key, _NOT_LOADED) for key in keys])
+        self._loader = loader
+        if stale is not None:
+            self._stale = stale
+        
+class LazyDataSet(_LazyColumns, DataSet):
+    """A DataSet whose columns are produced by loader(key) on first access, e.g. from memory-mapped files
+    error_loader, if not None, does the same for the errors"""
+    def __init__(self, keys, length, loader, error_loader=None):
+        dict.__init__(self, [(key, _NOT_LOADED) for key in keys])
+        self._loader = loader
+        self.sorted_views = {}
+        self._versions = {}
+        self._interpolators = {}
+        self.length = length
+        self.titles = {key: key for key in keys}
+        if error_loader is not None:
+            self.errors = LazyDict(keys, error_loader)
+        
+class RowView(_LazyColumns, DataSet):
+    """A DataSet of selected rows of a parent DataSet, storing only the row indices
+    columns and errors are gathered from the parent on first access, and gathered again if the parent column was changed since"""
+    def __init__(self, parent, indices):
+        dict.__init__(self, [(k, _NOT_LOADED) for k in parent])
+        self.parent = parent
+        self.indices = indices
+        self._versions = {}
+        self._interpolators = {}
+        self._gathered = {}     # {"key": version of the parent column when gathered}
+        self._assigned = set()  # columns assigned to the view itself
+        self.sorted_views = {}
+        self.length = indices.shape[0]
+        self.titles = parent.titles
+        self._gathered_errors = {}  # {"key": the parent's errors of key when gathered}
+        if parent.errors is not None:
+            self.errors = LazyDict(list(parent), self._gather_errors, self._errors_stale)
+            
+    def _loader(self, key):
+        self._gathered[key] = self.parent.version(key)
+        return self.parent[key][self.indices]
+        
+    def _gather_errors(self, key):
+        source = self.parent.errors[key]
+        self._gathered_errors[key] = source
+        return source[self.indices]
+        
+    def _errors_stale(self, key):
+        return (key in self._gathered_errors) and (self._gathered_errors[key] is not self.parent.errors[key])
+        
+    def _stale(self, key):
+        return (key in self._gathered) and (self._gathered[key] != self.parent.version(key))
+        
+    # a column assigned to the view itself belongs to the view
+    def __setitem__(self, key, value):
+        self._gathered.pop(key, None)
+        self._assigned.add(key)
+        super(RowView, self).__setitem__(key, value)
+        
+    # a gathered column changes with the parent's, so that sorted views and interpolators of the view are rebuilt
+    def version(self, key):
+        if key in self._assigned:
+            return self._versions.get(key, 0)
+        return (self._versions.get(key, 0), self.parent.version(key))
+        
+class SortedView(RowView):
+    """A DataSet sorted by one variable of a parent DataSet, storing only the permutation"""
+    def __init__(self, parent, key, indices):
+        super(SortedView, self).__init__(parent, indices)
+        self.key = key
+        self.source_version = parent.version(key)
+        self.source_errors = parent.errors
+        self.sorted_views = parent.sorted_views
+        
+    def is_current(self):
+        """whether the sorting still matches the parent"""
+        return ((self.source_version == self.parent.version(self.key)) and (self.source_errors is self.parent.errors)
+                    and (len(self) == len(self.parent)) and all(k in self for k in self.parent))
+        
+    # sorting a view by another variable is sorting the parent
+    def sort(self, key):
+        if (key == self.key) and self.is_current():
+            return self
+        else:
+            return self.parent.sort(key)
+            
+            
+class BlockDataSet(DataSet):
+    """A DataSet whose columns are the rows of a single (variables, rows) float64 array, self.block,
+    and whose errors, if any, are the rows of self.error_block
+    slices, row gathers and copies are then one array operation each, and the block can go as it is
+    to np.save, shared memory or the binary loggers; block.T is the (rows, variables) table
+    the columns are views of the block; a variable assigned later is a plain column, outside the block
+    a block that may be shared (the block given, a slice, or memory-mapped by load_npy) is copied before a variable
+    of it is assigned, so that the assignment never writes into another dataset or a read-only file"""
+    def __init__(self, var_order, block, error_block=None, var_titles=None):
+        dict.__init__(self)
+        self.var_order = list(var_order)
+        self.columns = {key: j for (j, key) in enumerate(self.var_order)}
+        self.buffer = np.asarray(block, dtype=np.float64)
+        if (self.buffer.ndim != 2) or (self.buffer.shape[0] != len(self.var_order)):
+            raise IndexError("[elflab.datasets.BlockDataSet] the block must have one row per variable")
+        self.error_buffer = None if error_block is None else np.asarray(error_block, dtype=np.float64)
+        self.owned = False      # whether the buffer belongs to this dataset only
+        self.sorted_views = {}
+        self._versions = {}
+        self._interpolators = {}
+        self._length = self.buffer.shape[1]
+        self.titles = {key: key for key in self.var_order} if var_titles is None else var_titles
+        self._error_views = None if self.error_buffer is None else {}
+        self.errors = self._error_views
+        self._views()
+            
+    @property
+    def length(self):
+        return self._length
+        
+    @length.setter
+    def length(self, value):
+        self._length = value
+        
+    @property
+    def block(self):
+        n = self.length     # may flush staged rows, and so replace the buffer
+        return self.buffer[:, :n]
+        
+    @property
+    def error_block(self):
+        n = self.length
+        return None if self.error_buffer is None else self.error_buffer[:, :n]
+        
+    # point the columns, and the errors unless they were replaced, at the filled part of the buffers
+    def _views(self):
+        n = self._length
+        for (j, key) in enumerate(self.var_order):
+            dict.__setitem__(self, key, self.buffer[j, :n])
+        if (self._error_views is not None) and (self.errors is self._error_views):
+            for (j, key) in enumerate(self.var_order):
+                self._error_views[key] = self.error_buffer[j, :n]
+                
+    # whether the block and the error block hold the whole dataset
+    def is_whole(self):
+        return (list(self) == self.var_order) and (self.errors is self._error_views)
+        
+    def __reduce__(self):
+        if not self.is_whole():
+            return super(BlockDataSet, self).__reduce__()
+        return (BlockDataSet, (self.var_order, self.block, self.error_block, self.titles))
+        
+    # a BlockDataSet of the rows select(array) of the block and of every other column; owned if select copies
+    def _new(self, select, owned=False):
+        new_set = BlockDataSet(self.var_order, select(self.block), None if self.error_buffer is None else select(self.error_block), self.titles.copy())
+        new_set.owned = owned
+        extras = [key for key in self if key not in self.columns]
+        for key in extras:
+            dict.__setitem__(new_set, key, select(self[key]))
+        if (self.errors is not None) and (self.errors is not self._error_views):
+            new_set.errors = {key: select(self.errors[key]) for key in self.errors}
+        elif self.errors is not None:
+            new_set.errors.update((key, select(self.errors[key])) for key in extras if key in self.errors)
+        return new_set
+        
+    def slice(self, start, stop):
+        return self._new(lambda a: a[..., start:stop])
+        
+    def take(self, rows):
+        return self._new(lambda a: a[..., rows], owned=True)
+        
+    def duplicate(self):
+        return self._new(lambda a: a.copy(), owned=True)
+        
+    # assigning a variable of the block writes into the block, copied first unless owned; any other variable
+    # is kept as a plain column
+    def __setitem__(self, key, value):
+        value = np.asarray(value, dtype=np.float64)
+        n = self.length
+        if value.shape != (n,):
+            raise IndexError("[elflab.datasets.BlockDataSet] a column must have {} values".format(n))
+        if key in self.columns:
+            if not self.owned:
+                self.buffer = self.buffer[:, :n].copy()
+                self.owned = True
+                for (j, name) in enumerate(self.var_order):
+                    dict.__setitem__(self, name, self.buffer[j])
+            self.buffer[self.columns[key], :n] = value
+        else:
+            dict.__setitem__(self, key, value)
+            self.titles.setdefault(key, key)
+        self._versions[key] = self._versions.get(key, 0) + 1
+        
+class AppendableDataSet(BlockDataSet):
+    """A BlockDataSet growing row by row or block by block, e.g. for live analysis or importers
+    the buffer holds capacity rows, and its capacity doubles when full;
+    single rows are staged in a list and written in blocks of FLUSH_ROWS, or whenever the data are looked at
+    the columns are views of the filled part, so arrays taken before a growth keep the old rows only
+    finish() returns a plain DataSet of the filled part, without copying"""
+    FLUSH_ROWS = 4096
+    
+    def __init__(self, var_order, capacity=1024, errors=False, var_titles=None):
+        capacity = max(int(capacity), 1)
+        block = np.empty((len(var_order), capacity), dtype=np.float64)
+        self._pending = []
+        self._pending_errors = []
+        super(AppendableDataSet, self).__init__(var_order, block, np.empty_like(block) if errors else None, var_titles)
+        self.owned = True
+        self.capacity = capacity
+        self._length = 0
+        self._views()
+        
+    # the number of rows, staged rows included
+    @property
+    def length(self):
+        self._flush_pending()
+        return self._length
+        
+    @length.setter
+    def length(self, value):
+        self._length = value
+        
+    # staged rows are written before the columns are looked at, by key or through dict methods
+    def _flush_pending(self):
+        if len(self._pending) > 0:
+            self._flush()
+            
+    def __getitem__(self, key):
+        self._flush_pending()
+        return dict.__getitem__(self, key)
+        
+    # not dict.__iter__ itself, so that dict(data) and {**data} go through __getitem__
+    def __iter__(self):
+        return dict.__iter__(self)
+        
+    def get(self, key, default=None):
+        self._flush_pending()
+        return dict.get(self, key, default)
+        
+    def values(self):
+        self._flush_pending()
+        return dict.values(self)
+        
+    def items(self):
+        self._flush_pending()
+        return dict.items(self)
+        
+    def copy(self):
+        self._flush_pending()
+        return dict.copy(self)
+        
+    # appending rows changes every column
+    def version(self, key):
+        return (self._versions.get(key, 0), self.length)
+        
+    def reserve(self, n):
+        """make room for n more rows"""
+        needed = self._length + n
+        if needed > self.capacity:
+            self.capacity = max(2 * self.capacity, needed)
+            self.buffer = self._grow(self.buffer)
+            if self.error_buffer is not None:
+                self.error_buffer = self._grow(self.error_buffer)
+            self._views()
+                
+    def _grow(self, buffer):
+        new_buffer = np.empty((buffer.shape[0], self.capacity), dtype=np.float64)
+        new_buffer[:, :self._length] = buffer[:, :self._length]
+        return new_buffer
+        
+    # write columns (variables, n) and their errors at the end of the buffer
+    def _write(self, columns, errors):
+        if len(self) > len(self.var_order):
+            raise IndexError("[elflab.datasets.AppendableDataSet] cannot append rows to columns outside the block")
+        n = columns.shape[1]
+        self.reserve(n)
+        self.buffer[:, self._length:self._length + n] = columns
+        if self.error_buffer is not None:
+            self.error_buffer[:, self._length:self._length + n] = np.nan if errors is None else errors
+        self._length += n
+        self._views()
+        
+    def _flush(self):
+        rows = np.array(self._pending, dtype=np.float64).T
+        errors = np.array(self._pending_errors, dtype=np.float64).T if self.error_buffer is not None else None
+        self._pending = []
+        self._pending_errors = []
+        self._write(rows, errors)
+        
+    def append_row(self, row, errors=None):
+        """append one row: {"name": value}, or values in the order of var_order; errors likewise"""
+        if isinstance(row, dict):
+            row = [row[key] for key in self.var_order]
+        self._pending.append(row)
+        if self.error_buffer is not None:
+            if errors is None:
+                errors = [np.nan] * len(self.var_order)
+            elif isinstance(errors, dict):
+                errors = [errors[key] for key in self.var_order]
+            self._pending_errors.append(errors)
+        if len(self._pending) >= self.FLUSH_ROWS:
+            self._flush()
+            
+    def extend_block(self, block, errors=None):
+        """append several rows: a DataSet or {"name": column}, or a 2D array of rows (rows, variables in var_order);
+        errors likewise; a DataSet with errors brings its own"""
+        self._flush_pending()
+        if isinstance(block, dict):
+            if (errors is None) and (getattr(block, "errors", None) is not None):
+                errors = block.errors
+            columns = as_block(block, self.var_order)
+        else:
+            columns = np.asarray(block, dtype=np.float64).T
+        if isinstance(errors, dict):
+            errors = np.array([errors[key] for key in self.var_order], dtype=np.float64)
+        elif errors is not None:
+            errors = np.asarray(errors, dtype=np.float64).T
+        self._write(columns, errors)
+        
+    def finish(self):
+        """a DataSet of the rows appended so far, its columns are views of the buffer"""
+        self._flush_pending()
+        data_set = DataSet([(key, dict.__getitem__(self, key)) for key in self])
         if self.errors is not None:
-            return interpolate.UnivariateSpline(sorted[x], sorted.errors[y], k=order, s=0)
+            data_set.errors = {key: self.errors[key] for key in self if key in self.errors}
+        data_set.titles = self.titles.copy()
+        return data_set
+        
+def as_block(dataset, var_order=None):
+    """the (variables, rows) array of the columns var_order (by default all) of a dataset
+    no copy for a BlockDataSet holding exactly these variables, in this order"""
+    var_order = list(dataset) if var_order is None else list(var_order)
+    if isinstance(dataset, BlockDataSet) and (dataset.var_order == var_order):
+        return dataset.block
+    return np.array([dataset[key] for key in var_order], dtype=np.float64)
+    
+        
+# Queries: vectorised conditions on the rows of a dataset, composed with &, | and ~, e.g.
+#   data.query(Column("T").between(2., 10.) & (Column("H") > 0.))
+# Range conditions are answered from the cached sorted view by binary search, the rest only on the rows in range
+class Condition:
+    """A condition on the rows of a dataset, function(dataset) returning a boolean array"""
+    def __init__(self, function):
+        self.function = function
+        
+    def mask(self, dataset):
+        return np.asarray(self.function(dataset), dtype=bool)
+        
+    def __and__(self, other):
+        return All([self, other])
+        
+    def __or__(self, other):
+        return Condition(lambda dataset: self.mask(dataset) | other.mask(dataset))
+        
+    def __invert__(self):
+        return Condition(lambda dataset: ~self.mask(dataset))
+        
+class All(Condition):
+    """All of several conditions"""
+    def __init__(self, conditions):
+        self.conditions = []
+        for condition in conditions:
+            self.conditions.extend(condition.conditions if isinstance(condition, All) else [condition])
+            
+    def mask(self, dataset):
+        mask = np.ones(dataset.length, dtype=bool)
+        for condition in self.conditions:
+            mask &= condition.mask(dataset)
+        return mask
+        
+class Range(Condition):
+    """lo <= dataset[key] <= hi, None meaning unbounded; the bounds are excluded if strict"""
+    def __init__(self, key, lo=None, hi=None, lo_strict=False, hi_strict=False):
+        self.key = key
+        self.lo = lo
+        self.hi = hi
+        self.lo_strict = lo_strict
+        self.hi_strict = hi_strict
+        
+    def mask(self, dataset):
+        values = dataset[self.key]
+        mask = ~np.isnan(values)
+        if self.lo is not None:
+            mask &= (values > self.lo) if self.lo_strict else (values >= self.lo)
+        if self.hi is not None:
+            mask &= (values < self.hi) if self.hi_strict else (values <= self.hi)
+        return mask
+        
+    def bounds(self, sorted_values):
+        """(start, stop) of the range in sorted_values, NaN's last"""
+        if self.lo is None:
+            start = 0
         else:
-            return interpolate.UnivariateSpline(sorted[x], sorted[y], k=order, s=0)
+            start = int(np.searchsorted(sorted_values, self.lo, side="right" if self.lo_strict else "left"))
+        if self.hi is None:
+            stop = int(np.searchsorted(sorted_values, np.inf, side="right"))
+        else:
+            stop = int(np.searchsorted(sorted_values, self.hi, side="left" if self.hi_strict else "right"))
+        return (start, max(start, stop))
+        
+class Column:
+    """Building conditions on one variable: Column("T") < 10., Column("H").between(-1., 1.)"""
+    def __init__(self, key):
+        self.key = key
         
-def load_csv(filepath, indices, error_column=0, has_header=True, use_header=True, **csv_params):
+    def __lt__(self, value):
+        return Range(self.key, hi=value, hi_strict=True)
+        
+    def __le__(self, value):
+        return Range(self.key, hi=value)
+        
+    def __gt__(self, value):
+        return Range(self.key, lo=value, lo_strict=True)
+        
+    def __ge__(self, value):
+        return Range(self.key, lo=value)
+        
+    def __eq__(self, value):
+        return Range(self.key, value, value)
+        
+    def __ne__(self, value):
+        return ~Range(self.key, value, value)
+        
+    __hash__ = None
+        
+    def between(self, lo=None, hi=None):
+        return Range(self.key, lo, hi)
+        
+    def isin(self, values):
+        return Condition(lambda dataset: np.isin(dataset[self.key], values))
+        
+    def isnan(self):
+        return Condition(lambda dataset: np.isnan(dataset[self.key]))
+        
+# compressed files are decompressed transparently according to their extensions
+COMPRESSED_OPENERS = {".gz": gzip.open, ".bz2": bz2.open, ".xz": lzma.open, ".lzma": lzma.open}
+
+def open_text(filepath, mode="rt", newline=''):
+    """open a text file, transparently (de)compressing .gz / .bz2 / .xz / .lzma files"""
+    opener = COMPRESSED_OPENERS.get(os.path.splitext(filepath)[1].lower())
+    if opener is None:
+        return open(filepath, mode, newline=newline)
+    else:
+        return opener(filepath, mode, newline=newline)
+        
+# load_csv parses blocks of about this many characters at a time
+DEFAULT_CHUNK_SIZE = 1 << 20
+# number of rows per chunk when streaming
+DEFAULT_CHUNK_ROWS = 65536
+
+def _parse_rows(rows, columns):
+    # the slow path: float() on every cell; unparseable or missing cells become NaN
+    block = np.empty((len(rows), len(columns)), dtype=np.float64)
+    for (r, row) in enumerate(rows):
+        for (c, i) in enumerate(columns):
+            try:
+                block[r, c] = float(row[i])
+            except (ValueError, IndexError):
+                block[r, c] = np.nan
+    return block
+
+def _parse_lines(lines, columns, csv_params):
+    """parse a list of csv text lines into a 2D array, block[row, j] = value in column columns[j]"""
+    # fast path: numpy's parser on the whole block, as long as the dialect is a plain one
+    if set(csv_params) <= {"delimiter"}:
+        try:
+            return np.loadtxt(lines, dtype=np.float64, delimiter=csv_params.get("delimiter", ","), quotechar='"',
+                              comments=None, usecols=columns, ndmin=2).reshape(-1, len(columns))
+        except (ValueError, IndexError, TypeError):
+            pass
+    rows = [row for row in csv.reader(lines, **csv_params) if len(row) > 0]
+    return _parse_rows(rows, columns)
+
+def _iter_csv(f, columns, chunk_size, csv_params):
+    # yields 2D blocks of the data lines remaining in the open file f
+    while True:
+        lines = f.readlines(chunk_size)
+        if len(lines) == 0:
+            break
+        block = _parse_lines(lines, columns, csv_params)
+        if block.shape[0] > 0:
+            yield block
+
+def _read_header(f, has_header, use_header, indices, csv_params):
+    # reads the header line if applicable, returns the titles
+    titles = {key: key for (i, key) in indices}
+    if has_header:
+        row = next(csv.reader([f.readline()], **csv_params))
+        if use_header:
+            titles = {key: row[i] for (i, key) in indices}
+    return titles
+
+def iter_csv(filepath, indices, chunk_rows=DEFAULT_CHUNK_ROWS, error_column=0, has_header=True, use_header=True, **csv_params):
+    """iterate over a csv file in DataSets of chunk_rows rows (the last one may be shorter), reading it only once,
+    with constant memory; the arguments are the same as for load_csv"""
+    columns = [i for (i, key) in indices]
+    if error_column > 0:
+        columns += [i + error_column for (i, key) in indices]
+    n = len(indices)
+    def to_dataset(block):
+        data_set = DataSet([(key, block[:, j]) for (j, (i, key)) in enumerate(indices)])
+        if error_column > 0:
+            data_set.errors = {key: block[:, j + n] for (j, (i, key)) in enumerate(indices)}
+        data_set.titles = titles
+        return data_set
+    with open_text(filepath) as f:
+        titles = _read_header(f, has_header, use_header, indices, csv_params)
+        for chunk in rechunk((to_dataset(block) for block in _iter_csv(f, columns, DEFAULT_CHUNK_SIZE, csv_params)), chunk_rows):
+            yield chunk
+            
+def load_csv(filepath, indices, error_column=0, has_header=True, use_header=True, chunk_size=DEFAULT_CHUNK_SIZE, **csv_params):
     """read data from a csv file, assuming no error values are recorded
     indices = [(row_index1,variable_name1), ...], has to be specified by user
     If use_header == True, then the headers will be read as the full titles of the variables
-    error_column > 0 if the file contains error information on the values, and stored starting at error_column in the same order of value columns."""              
-    # prepare the temporary lists for reading the data
-    data_lists = {key:[] for (i,key) in indices}
-    if error_column:
-        error_lists = {key:[] for (i,key) in indices}       
-    # read the file
-    with open(filepath, "r", newline='') as f:  
-        reader = csv.reader(f,**csv_params)
-        # Read the header row if applicable
-        if has_header:
-            row = next(reader)
-            if use_header:
-                titles = {key: row[i] for (i, key) in indices}
-            else:
-                titles = {key: key for (i, key) in indices}
-        else:
-            titles = {key: key for (i, key) in indices}
-        # now read the data
-        for row in reader:
-            for (i,key) in indices:            
-                try:
-                    data_lists[key].append(float(row[i]))
-                except ValueError:
-                    data_lists[key].append(np.nan)
-                
-                if error_column > 0:
-                    try:
-                        error_lists[key].append(float(row[i+error_column]))
-                    except ValueError:
-                        error_lists[key].append(np.nan)
-                    
-    
-    # Convert data to the dataset format
-    data_set = DataSet([(key, np.array(data_lists[key], dtype=np.float) ) for (i, key) in indices])
-    data_set.titles = titles
+    error_column > 0 if the file contains error information on the values, and stored starting at error_column in the same order of value columns.
+    The file is parsed in blocks of about chunk_size characters; unparseable cells are read as NaN"""
+    columns = [i for (i, key) in indices]
     if error_column > 0:
-        data_set.errors = {key: np.array(error_lists[key], dtype=np.float) for (i, key) in indices}
-    return data_set
+        columns += [i + error_column for (i, key) in indices]
+    n = len(indices)
+    # read the file, appending the parsed blocks to the dataset
+    with open_text(filepath) as f:
+        titles = _read_header(f, has_header, use_header, indices, csv_params)
+        data_set = AppendableDataSet([key for (i, key) in indices], errors=(error_column > 0), var_titles=titles)
+        for block in _iter_csv(f, columns, chunk_size, csv_params):
+            data_set.extend_block(block[:, :n], block[:, n:] if error_column > 0 else None)
+    return data_set.finish()
     
+# save_csv formats and writes this many rows at a time
+SAVE_CHUNK_ROWS = 65536
+
+_PRINTF_SPEC = re.compile(r"^[-+ 0#]*\d*(\.\d+)?[eEfFgG]$")
+_FORMAT_SPEC = re.compile(r"^(?:(?P<fill>.)?[<>=^])?[-+ ]?z?#?(?P<zero>0)?(?P<width>\d+)?")
+_NUMBER_CHARACTERS = "0123456789+-.eEinfaINFA"     # besides the spec, what formatting a float can produce
+
+def _line_template(format_string, cells, dialect):
+    """build a template formatting a whole line at once, or return None if that can't reproduce csv.writer exactly
+    cells: one entry per column of the line, True for a value, False for an empty cell
+    returns (template, use_printf)"""
+    parsed = list(string.Formatter().parse(format_string))
+    if (len(parsed) != 1) or (parsed[0][1] != "") or (parsed[0][3] is not None):
+        return None
+    (literal, field, spec, conversion) = parsed[0]
+    # the formatted values must never need quoting: no character csv.writer quotes for may appear in them,
+    # including the padding, spaces unless another fill is given
+    produced = literal + spec + _NUMBER_CHARACTERS
+    padding = _FORMAT_SPEC.match(spec)
+    if (padding.group("width") is not None) and (padding.group("zero") is None):
+        produced += padding.group("fill") or " "
+    for c in (dialect.delimiter, dialect.quotechar, dialect.escapechar, "\r", "\n") + tuple(dialect.lineterminator):
+        if (c is not None) and (c in produced):
+            return None
+    if spec.endswith("n"):  # locale dependent
+        return None
+    if (literal == "") and _PRINTF_SPEC.match(spec):
+        return (dialect.delimiter.replace("%", "%%").join("%" + spec if cell else "" for cell in cells), True)
+    literal = literal.replace("{", "{{").replace("}", "}}")
+    template = []
+    k = 0
+    for cell in cells:
+        if cell:
+            template.append("{}{{{}:{}}}".format(literal, k, spec))
+            k += 1
+        else:
+            template.append("")
+    return (dialect.delimiter.replace("{", "{{").replace("}", "}}").join(template), False)
+
 def save_csv(dataset, filepath, indices, format_string="{:.10g}", data_columns=0, write_header=True, **csv_params):
     """write data to a csv file, assuming no error values are recorded
     indices = [(row_index1,variable1), ...], not including errors
@@ -122,14 +820,20 @@ def save_csv(dataset, filepath, indices, format_string="{:.10g}", data_columns=0
         else:
             N = data_columns
     
-    # create an empty row
+    # create an empty row, and the columns of a data row, in order
     if dataset.errors is None:
         row = ['' for i in range(N)]
     else:
         row = ['' for i in range(2*N)]
+    sources = [None for i in range(len(row))]
+    for (i, key) in indices:
+        sources[i] = dataset[key]
+        if dataset.errors is not None:
+            sources[i+N] = dataset.errors[key]
+    columns = [column for column in sources if column is not None]
         
     # write to file
-    with open(filepath, "w", newline='') as f:  
+    with open_text(filepath, "wt") as f:  
         writer = csv.writer(f, **csv_params)
         # write header line
         if write_header:
@@ -141,34 +845,225 @@ def save_csv(dataset, filepath, indices, format_string="{:.10g}", data_columns=0
                 for (i, key) in indices:
                     row[i+N] = "error({})".format(dataset.titles[key])
             writer.writerow(row)
-        # write data lines
-        for i in range(dataset.length):
-            for (j,key) in indices:
-                row[j] = format_string.format(dataset[key][i])
-            if dataset.errors is not None:
-                for (j,key) in indices:
-                    row[j+N] = format_string.format(dataset.errors[key][i])
-            writer.writerow(row)
+            
+        # write data lines, formatting a whole line with a single template where possible
+        dialect = writer.dialect
+        template = None
+        if (dialect.quoting == csv.QUOTE_MINIMAL) and (len(row) > 1):
+            template = _line_template(format_string, [column is not None for column in sources], dialect)
+        if template is not None:
+            (line, use_printf) = template
+            line = line + dialect.lineterminator.replace("%", "%%").replace("{", "{{").replace("}", "}}")
+            for i0 in range(0, dataset.length, SAVE_CHUNK_ROWS):
+                values = zip(*[column[i0:i0+SAVE_CHUNK_ROWS].tolist() for column in columns])
+                if use_printf:
+                    f.write("".join([line % v for v in values]))
+                else:
+                    f.write("".join([line.format(*v) for v in values]))
+        else:
+            for i in range(dataset.length):
+                for (j, column) in enumerate(sources):
+                    if column is not None:
+                        row[j] = format_string.format(column[i])
+                writer.writerow(row)
     
 
+# Reducers over consecutive segments of a 1D array: reducer(values, starts) returns one value per segment,
+# segment i being values[starts[i]:starts[i+1]] (the last one runs to the end); starts must be strictly increasing.
+# NaN's are ignored, like np.nanmean etc.
+def _segment_count(values, starts):
+    return np.add.reduceat((~np.isnan(values)).astype(np.intp), starts)
+
+def _segment_lengths(values, starts):
+    return np.diff(np.append(starts, values.shape[0]))
+
+def reduce_count(values, starts):
+    return _segment_count(values, starts).astype(np.float64)
+
+def reduce_mean(values, starts):
+    total = np.add.reduceat(np.where(np.isnan(values), 0., values), starts)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return total / _segment_count(values, starts)
+
+def reduce_std(values, starts, ddof=1):
+    # two passes: deviations from each segment's own mean keep the precision
+    deviations = values - np.repeat(reduce_mean(values, starts), _segment_lengths(values, starts))
+    total = np.add.reduceat(np.where(np.isnan(deviations), 0., deviations**2), starts)
+    dof = (_segment_count(values, starts) - ddof).astype(np.float64)
+    dof[dof <= 0] = np.nan
+    return np.sqrt(total / dof)
+
+def reduce_se(values, starts):
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return reduce_std(values, starts) / np.sqrt(_segment_count(values, starts))
+
+def reduce_min(values, starts):
+    return np.fmin.reduceat(values, starts)
+
+def reduce_max(values, starts):
+    return np.fmax.reduceat(values, starts)
+
+def reduce_median(values, starts):
+    lengths = _segment_lengths(values, starts)
+    count = _segment_count(values, starts)
+    if (lengths[:-1] == lengths[0]).all():
+        # equal segments but maybe the last: a plain 2D median
+        n = lengths[0] * (lengths.shape[0] - 1)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)     # all-NaN segments
+            return np.append(np.nanmedian(values[:n].reshape(-1, lengths[0]), axis=1), np.nanmedian(values[n:]))
+    # general case: sort within each segment, NaN's go last, then average the middle two of the valid entries
+    ordered = values[np.lexsort((values, np.repeat(np.arange(lengths.shape[0]), lengths)))]
+    count1 = np.maximum(count, 1)
+    result = 0.5 * (ordered[starts + (count1 - 1) // 2] + ordered[starts + count1 // 2])
+    result[count == 0] = np.nan
+    return result
+
+REDUCERS = {"mean": reduce_mean,
+            "median": reduce_median,
+            "min": reduce_min,
+            "max": reduce_max,
+            "std": reduce_std,
+            "se": reduce_se,
+            "count": reduce_count
+           }
+# numpy functions with the same meaning as a vectorised reducer
+_EQUIVALENT_REDUCERS = {np.nanmean: "mean", np.nanmedian: "median", np.nanmin: "min", np.nanmax: "max"}
+
+def reduce_segments(reducer, values, starts):
+    """apply reducer, a name in REDUCERS or a function of the values of one segment, to every segment of values"""
+    values = np.asarray(values, dtype=np.float64)
+    if values.shape[0] == 0:
+        return np.empty((0,), dtype=np.float64)
+    reducer = _EQUIVALENT_REDUCERS.get(reducer, reducer)
+    if reducer in REDUCERS:
+        return REDUCERS[reducer](values, starts)
+    if isinstance(reducer, str):
+        raise ValueError("[elflab.datasets.reduce_segments] unknown reducer \"{}\"".format(reducer))
+    stops = np.append(starts[1:], values.shape[0])
+    return np.array([reducer(values[i0:i1]) for (i0, i1) in zip(starts, stops)], dtype=np.float64)
+
+def reduce_segment_errors(error_est, values, errors, starts):
+    """estimate the errors of reduced segments:
+    error_est = None: propagate the errors, if any, as for a mean: sqrt(sum(error^2)) / n; returns None without errors
+    error_est = a name in REDUCERS: that statistic of the values, e.g. "se" or "std"
+    error_est = a function (values, errors) of one segment, as in elflab.errors"""
+    if error_est is None:
+        if errors is None:
+            return None
+        errors = np.asarray(errors, dtype=np.float64)
+        total = np.add.reduceat(np.where(np.isnan(errors), 0., errors**2), starts)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.sqrt(total) / _segment_count(errors, starts)
+    if isinstance(error_est, str):
+        return reduce_segments(error_est, values, starts)
+    if errors is None:
+        errors = np.zeros(np.shape(values))
+    stops = np.append(starts[1:], np.shape(values)[0])
+    return np.array([error_est(values[i0:i1], errors[i0:i1]) for (i0, i1) in zip(starts, stops)], dtype=np.float64)
+
 def downsample(dataset, size, averaging=np.nanmean, error_est=None):
     """Down sampling the dataset by averaging function "averaging"
-    size is the window size
-    new errors are estimated with the function "error_est"
+    size is the window size; the last window also takes the remaining (length % size) points
+    averaging is a name in REDUCERS ("mean", "median", "min", "max", "std", "se", "count") or any function of a window
+    new errors are estimated with "error_est", see reduce_segment_errors(); None propagates the old errors, if any
     return the down-sampled dataset"""
-    # If the old set has errors undefined, set all errors as zero
-    if dataset.errors is None:
-        dataset.errors = {key:np.zeros((dataset.length,), dtype=np.float) for key in dataset}
-    # prepare an empty new set
-    new_length = dataset.length // size
-    newset = DataSet([(key, np.empty((new_length,), dtype=np.float)) for key in dataset])
-    newset.errors = {key: np.empty((new_length,), dtype=np.float) for key in dataset}
-    
-    # calculate the values in the new set
-    for key in dataset:
-        for i in range(new_length-1):
-            newset[key][i] = averaging(dataset[key][i*size:(i+1)*size])
-            newset.errors[key][i] = error_est(dataset[key][i*size:(i+1)*size], dataset.errors[key][i*size:(i+1)*size])
-        newset[key][new_length-1] = averaging(dataset[key][(new_length-1)*size:dataset.length])
-        newset.errors[key][new_length-1] = error_est(dataset[key][(new_length-1)*size:dataset.length], dataset.errors[key][(new_length-1)*size:dataset.length])
-    return newset
\ No newline at end of file
+    new_length = max(dataset.length // size, 1) if dataset.length > 0 else 0
+    starts = np.arange(new_length, dtype=np.intp) * size
+    newset = DataSet([(key, reduce_segments(averaging, dataset[key], starts)) for key in dataset])
+    if (error_est is not None) or (dataset.errors is not None):
+        newset.errors = {key: reduce_segment_errors(error_est, dataset[key], None if dataset.errors is None else dataset.errors[key], starts)
+                            for key in dataset}
+    newset.titles = dataset.titles.copy()
+    return newset
+
+def concatenate(sets):
+    """join a list of datasets with identical variables end to end, returns a new dataset
+    errors are kept only if every set has them; a variable missing from the errors of a set gets NaN's there"""
+    sets = list(sets)
+    if len(sets) == 0:
+        raise ValueError("[elflab.datasets.concatenate] nothing to concatenate")
+    keys = list(sets[0])
+    new_set = DataSet([(key, np.concatenate([s[key] for s in sets])) for key in keys])
+    if all(s.errors is not None for s in sets):
+        new_set.errors = {key: np.concatenate([s.errors[key] if key in s.errors else np.full(s.length, np.nan) for s in sets])
+                            for key in keys}
+    new_set.titles = sets[0].titles.copy()
+    return new_set
+
+
+# On-disk columnar storage: a folder with one .npy file per column, and a json description
+NPY_INDEX = "dataset.json"
+NPY_BLOCK = "block.npy"
+NPY_ERROR_BLOCK = "errors.npy"
+
+def save_npy(dataset, folder):
+    """save a dataset as a folder of .npy columns, which load_npy() can memory-map
+    a BlockDataSet with no columns outside its block is saved as a single block.npy (and errors.npy),
+    and loads back as a BlockDataSet"""
+    os.makedirs(folder, exist_ok=True)
+    keys = list(dataset)
+    block = isinstance(dataset, BlockDataSet) and dataset.is_whole()
+    if block:
+        np.save(os.path.join(folder, NPY_BLOCK), dataset.block)
+        if dataset.errors is not None:
+            np.save(os.path.join(folder, NPY_ERROR_BLOCK), dataset.error_block)
+    else:
+        for (j, key) in enumerate(keys):
+            np.save(os.path.join(folder, "column_{}.npy".format(j)), np.ascontiguousarray(dataset[key]))
+            if dataset.errors is not None:
+                np.save(os.path.join(folder, "error_{}.npy".format(j)), np.ascontiguousarray(dataset.errors[key]))
+    description = {"keys": keys,
+                   "titles": {key: dataset.titles[key] for key in keys} if dataset.titles is not None else None,
+                   "length": dataset.length,
+                   "errors": dataset.errors is not None,
+                   "block": block
+                  }
+    with open(os.path.join(folder, NPY_INDEX), "w") as f:
+        json.dump(description, f, indent=1)
+        
+def load_npy(folder, mmap_mode="r"):
+    """open a folder written by save_npy() as a LazyDataSet: each column is memory-mapped (or read, if mmap_mode is None)
+    only when first accessed, so datasets larger than memory can be analysed a few columns at a time
+    a saved BlockDataSet comes back as a BlockDataSet over the memory-mapped block"""
+    with open(os.path.join(folder, NPY_INDEX), "r") as f:
+        description = json.load(f)
+    keys = description["keys"]
+    if description.get("block", False):
+        block = np.load(os.path.join(folder, NPY_BLOCK), mmap_mode=mmap_mode)
+        error_block = np.load(os.path.join(folder, NPY_ERROR_BLOCK), mmap_mode=mmap_mode) if description["errors"] else None
+        return BlockDataSet(keys, block, error_block, description["titles"])
+    numbers = {key: j for (j, key) in enumerate(keys)}
+    def loader(key):
+        return np.load(os.path.join(folder, "column_{}.npy".format(numbers[key])), mmap_mode=mmap_mode)
+    def error_loader(key):
+        return np.load(os.path.join(folder, "error_{}.npy".format(numbers[key])), mmap_mode=mmap_mode)
+    data_set = LazyDataSet(keys, description["length"], loader, error_loader if description["errors"] else None)
+    if description["titles"] is not None:
+        data_set.titles = description["titles"]
+    return data_set
+
+
+# Streaming: chunks of rows as small DataSets
+def iter_dataset(dataset, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """iterate over a dataset (e.g. a memory-mapped one) in zero-copy chunks of chunk_rows rows"""
+    for i in range(0, dataset.length, chunk_rows):
+        yield dataset.slice(i, i + chunk_rows)
+        
+def rechunk(chunks, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """regroup an iterable of datasets with identical variables into chunks of exactly chunk_rows rows,
+    but the last one; only as many rows as a chunk are buffered"""
+    pending = []
+    n = 0
+    for chunk in chunks:
+        while chunk.length > 0:
+            take = min(chunk_rows - n, chunk.length)
+            pending.append(chunk.slice(0, take))
+            n += take
+            chunk = chunk.slice(take, chunk.length)
+            if n == chunk_rows:
+                yield pending[0] if len(pending) == 1 else concatenate(pending)
+                pending = []
+                n = 0
+    if n > 0:
+        yield pending[0] if len(pending) == 1 else concatenate(pending)
@@ -22,11 +22,11 @@ def std(values, errors):
     
 # standard error of the mean
 def se(values, errors=None):
-    n = values.size
+    n = np.count_nonzero(~np.isnan(values))
     if n <= 1:
-        raise ValueError
+        raise ValueError("[elflab.errors.se] at least two values are needed")
     st = np.nanstd(values)
-    se = st / sqrt(n-1)
+    return st / np.sqrt(n-1)
     
     
 # an estimator that gives median value of the input errors as error
@@ -62,8 +62,11 @@ class Galileo(elflab.abstracts.KernelBase):
             QUESTIONS.append(line.strip())
       
 
-    def __init__(self, experiment, plot_refresh_interval=DEFAULT_PLOT_REFRESH_INTERVAL, plot_listen_interval=DEFAULT_PLOT_LISTEN_INTERVAL, data_lock=None, instrument_lock=None):
+    def __init__(self, experiment, plot_refresh_interval=DEFAULT_PLOT_REFRESH_INTERVAL, plot_listen_interval=DEFAULT_PLOT_LISTEN_INTERVAL, data_lock=None, instrument_lock=None, derived=None):
               # (self, Experiment object, XYs for the sub-plots, ...) 
+              # derived: [(new key, source key, filter)], columns filtered live from measured ones, with any
+              #   analysis.filters.StreamFilter; to log them, add the new keys to the logger's var_order, var_titles
+              #   and format_strings; to plot them, to the experiment's var_titles
         print("    [Galileo:] Initialising Galileo......")
         # set flags
         self.flag_stop = True
@@ -74,6 +77,7 @@ class Galileo(elflab.abstracts.KernelBase):
         self.experiment = experiment
         self.measurement_interval = experiment.measurement_interval
         self.plotXYs = experiment.plotXYs
+        self.derived = [] if derived is None else list(derived)
         
         # ____the timing "constants", all in seconds
         self.plot_refresh_interval = plot_refresh_interval
@@ -135,6 +139,8 @@ class Galileo(elflab.abstracts.KernelBase):
                 
                 # start another logging thread
                 with data_lock:
+                    for (key, source, stream_filter) in self.derived:
+                        self.experiment.current_values[key] = stream_filter.update(self.experiment.current_values[source])
                     self.current_values = self.experiment.current_values.copy()
                 logThread = threading.Thread(target=self.experiment.log, name="Galileo:data-logging", kwargs={"dataToLog":self.current_values})
                 logThread.start()
@@ -717,16 +717,10 @@ def loadfile(filename):
     with open(filename, mode="r") as f:
         reader = csv.reader(f)
         next(reader)
-        datalist = []
-        for var in VAR_ORDER:
-            datalist.append([])
+        data = datasets.AppendableDataSet(VAR_ORDER)
         for row in reader:
-            for i in range(0, len(row)):
-                datalist[i].append(float(row[i]))
+            values = [float(x) for x in row]
             # For backward compatibility #
-            for i in range(len(row), len(VAR_ORDER)):
-                datalist[i].append(float('nan'))
-        datadict = {}
-        for i in range(0, len(VAR_ORDER)):
-            datadict[VAR_ORDER[i]] = np.array(datalist[i], dtype=np.float_)
-        return datasets.DataSet(datadict)
+            values += [float('nan')] * (len(VAR_ORDER) - len(row))
+            data.append_row(values)
+        return data.finish()
@@ -1,16 +1,22 @@
-
 import mi_common as mi
 import numpy as np
 import matplotlib.pyplot as plt
 
+import elflab.datasets as datasets
+from elflab.analysis import lockin
+
+PHASE = None        # phase offset in degrees (was 180. + 76.), None to estimate it from the data
+PHASE_REGION = None # e.g. datasets.Column("T").between(30., 40.), to estimate the phase from that region only
+
 
-if __name__ == '__main__': 
-    data=mi.loadfile(r"D:\Dropbox\work\2014, MI\data\20140220\20140220_11.26.54_MgB2_Tscan_13.6kHz_cooling.csv")
-    Ts=data["T"]
-    Rs=data["R"]
-    ths=data["theta"]
-    Xs = Rs * np.cos((ths + 180. + 76.) * np.pi / 180.)
-    Ys = Rs * np.sin((ths + 180.+ 76.) * np.pi / 180.)
+if __name__ == '__main__':
+    data = datasets.DataSet(mi.loadfile(r"D:\Dropbox\work\2014, MI\data\20140220\20140220_11.26.54_MgB2_Tscan_13.6kHz_cooling.csv"))
+    phase = lockin.estimate_phase(data, r="R", theta="theta", region=PHASE_REGION) if PHASE is None else PHASE
+    print("phase offset: {:.2f} degree".format(phase))
+    rotated = lockin.rotate(data, phase, r="R", theta="theta")
+    Ts = rotated["T"]
+    Xs = rotated["X"]
+    Ys = rotated["Y"]
 
     plt.plot(Ts, Xs, "bx", Ts, Ys, "r+")
 
@@ -18,4 +24,4 @@ if __name__ == '__main__':
     plt.xlabel("$T$ / K")
     plt.ylabel("$V_{out}$ / V")
 
-    plt.show()
\ No newline at end of file
+    plt.show()
@@ -4,89 +4,33 @@ import numpy as np
 
 import elflab.datasets as datasets
  
+# read one cell as a float, NaN if it is not a number
+def _float(text):
+    try:
+        return float(text)
+    except ValueError:
+        return np.nan
+        
 # Import PPMS dc data    
 def import_dc(filename):
-    # initialize lists for reading
-    ltime = []
-    lT = []
-    lH = []
-    lch1R = []
-    lch1err = []
-    lch2R = []
-    lch2err = []
-    lch3R = []
-    lch3err = []
+    # rows are appended to a growing dataset
+    data = datasets.AppendableDataSet(["time", "T", "H", "R1", "R2", "R3", "err_R1", "err_R2", "err_R3"])
     # reading data
     with open(filename, "r", newline='') as f:
         reader = csv.reader(f)
         for row in reader:
             if row[0] == "":    # a valid data line only if the comment entry is ""
-                try:
-                    ltime.append(float(row[1]))
-                except ValueError:
-                    ltime.append(np.nan)
-                    
-                try:
-                    lT.append(float(row[3]))
-                except ValueError:
-                    lT.append(np.nan)
-                    
-                try:
-                    lH.append(float(row[4]))
-                except ValueError:
-                    lH.append(np.nan)
-                    
-                try:
-                    lch1R.append(float(row[19]))
-                except ValueError:
-                    lch1R.append(np.nan)
-                    
-                try:
-                    lch2R.append(float(row[20]))
-                except ValueError:
-                    lch2R.append(np.nan)
-                
-                try:
-                    lch3R.append(float(row[21]))
-                except ValueError:
-                    lch3R.append(np.nan)
-                
                 # Calculating the standard errors assuming the stupid default resistivity calculation made by PPMS
-                try:
-                    lch1err.append(float(row[14]) * 1.e3 / float(row[18])**0.5)
-                except ValueError:
-                    lch1err.append(np.nan)
-                
-                try:
-                    lch2err.append(float(row[15]) * 1.e3 / float(row[18])**0.5)
-                except ValueError:
-                    lch2err.append(np.nan)
-                    
-                try:
-                    lch3err.append(float(row[16]) * 1.e3 / float(row[18])**0.5)
-                except ValueError:
-                    lch3err.append(np.nan)
+                errors = [_float(row[i]) * 1.e3 / _float(row[18])**0.5 for i in (14, 15, 16)]
+                data.append_row([_float(row[1]), _float(row[3]), _float(row[4]), _float(row[19]), _float(row[20]), _float(row[21])] + errors)
                 
-    # Convert lists to datasets (dicts of 1D numpy arrays)
-    ch1 = datasets.DataSet([
-                            ("time", np.array(ltime, dtype=np.float_, copy=True)),
-                            ("T", np.array(lT, dtype=np.float_, copy=True)),
-                            ("H", np.array(lH, dtype=np.float_, copy=True)),
-                            ("R", np.array(lch1R, dtype=np.float_, copy=True)),
-                            ("err_R", np.array(lch1err, dtype=np.float_, copy=True))
-                            ])
-    ch2 = datasets.DataSet([
-                            ("time", np.array(ltime, dtype=np.float_, copy=True)),
-                            ("T", np.array(lT, dtype=np.float_, copy=True)),
-                            ("H", np.array(lH, dtype=np.float_, copy=True)),
-                            ("R", np.array(lch2R, dtype=np.float_, copy=True)),
-                            ("err_R", np.array(lch2err, dtype=np.float_, copy=True))
-                            ])
-    ch3 = datasets.DataSet([
-                            ("time", np.array(ltime, dtype=np.float_, copy=True)),
-                            ("T", np.array(lT, dtype=np.float_, copy=True)),
-                            ("H", np.array(lH, dtype=np.float_, copy=True)),
-                            ("R", np.array(lch3R, dtype=np.float_, copy=True)),
-                            ("err_R", np.array(lch3err, dtype=np.float_, copy=True))
-                            ])
-    return (ch1, ch2, ch3)
\ No newline at end of file
+    # Split into one dataset per channel; each has its own copy of the common variables
+    def channel(n):
+        return datasets.DataSet([
+                                ("time", data["time"].copy()),
+                                ("T", data["T"].copy()),
+                                ("H", data["H"].copy()),
+                                ("R", data["R{}".format(n)]),
+                                ("err_R", data["err_R{}".format(n)])
+                                ])
+    return (channel(1), channel(2), channel(3))
\ No newline at end of file
@@ -0,0 +1,21 @@
+import functools
+
+import numpy as np
+
+import elflab.datasets as datasets
+from elflab.analysis import batch
+
+
+def test_run_with_errors(tmp_path):
+    for i in range(2):
+        with open(str(tmp_path / "run_{}.csv".format(i)), "w") as f:
+            f.write("a,b,err_a,err_b\n")
+            for j in range(3):
+                f.write("{},{},0.1,0.2\n".format(j, 10 * i + j))
+    loader = functools.partial(datasets.load_csv, indices=[(0, "a"), (1, "b")], error_column=2)
+    (data, files) = batch.run(str(tmp_path / "*.csv"), loader, processes=None, progress=False)
+    assert len(files) == 2
+    assert np.array_equal(data["b"], [0., 1., 2., 10., 11., 12.])
+    assert np.array_equal(data["source"], [0., 0., 0., 1., 1., 1.])
+    assert np.array_equal(data.errors["source"], np.zeros(6))
+    assert np.allclose(data.errors["b"], 0.2)
@@ -0,0 +1,32 @@
+import warnings
+
+import numpy as np
+
+import elflab.datasets as datasets
+from elflab.analysis import cache
+
+
+def _with_new_column(n):
+    data = datasets.DataSet([("a", np.arange(float(n)))])
+    data["b"] = data["a"] * 2.
+    return data
+    
+def _unpicklable(n):
+    return lambda: n
+    
+def test_memoize_column_without_title(tmp_path):
+    memoized = cache.Cache(str(tmp_path)).memoize(_with_new_column)
+    first = memoized(3)
+    second = memoized(3)
+    assert memoized.cache.hits == 1
+    assert np.array_equal(second["b"], first["b"])
+    assert second.titles["b"] == "b"
+    
+def test_memoize_warns_when_not_stored(tmp_path):
+    memoized = cache.Cache(str(tmp_path)).memoize(_unpicklable)
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        assert memoized(3)() == 3
+    assert any(issubclass(w.category, RuntimeWarning) for w in caught)
+    assert memoized.cache.entries() == []
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,138 @@
+import io
+import csv
+
+import numpy as np
+
+import elflab.datasets as datasets
+
+
+def test_append_past_capacity():
+    data = datasets.AppendableDataSet(["x", "y"], capacity=2)
+    for i in range(10):
+        data.append_row([i, 2 * i])
+    assert np.array_equal(data["x"], np.arange(10))
+    assert np.array_equal(data["y"], 2 * np.arange(10))
+    
+def test_finish_after_staged_rows():
+    data = datasets.AppendableDataSet(["x"], errors=True)
+    n = 3000
+    for i in range(n):
+        data.append_row([i], [0.5])
+    finished = data.finish()
+    assert finished.length == n
+    assert np.array_equal(finished["x"], np.arange(n))
+    assert np.array_equal(finished.errors["x"], np.full(n, 0.5))
+    
+def test_block_dataset_is_a_plain_dict():
+    data = datasets.BlockDataSet(["a", "b"], np.arange(6.).reshape(2, 3), np.ones((2, 3)))
+    for copied in (dict(data), {**data}, data.copy(), datasets.DataSet(data)):
+        assert np.array_equal(copied["b"], [3., 4., 5.])
+    block = data.buffer
+    data["c"] = np.zeros(3)
+    assert data.buffer is block
+    assert not data.is_whole()
+    assert np.array_equal(data.slice(1, 3)["c"], [0., 0.])
+    
+def test_block_errors_assigned_by_user():
+    data = datasets.BlockDataSet(["a"], np.zeros((1, 3)), np.zeros((1, 3)))
+    errors = {"a": np.ones(3)}
+    data.errors = errors
+    data["a"] = np.arange(3.)
+    data["c"] = np.arange(3.)
+    assert data.errors is errors
+    assert np.array_equal(data.errors["a"], np.ones(3))
+    
+def test_finish_is_a_dataset():
+    data = datasets.AppendableDataSet(["x"], capacity=4)
+    data.extend_block(np.arange(10.).reshape(10, 1))
+    data.append_row([10.])
+    assert np.array_equal(dict(data)["x"], np.arange(11))
+    finished = data.finish()
+    assert type(finished) is datasets.DataSet
+    assert np.array_equal(finished.copy()["x"], np.arange(11))
+    
+def test_views_behave_as_dicts():
+    data = datasets.DataSet([("H", np.array([3., 1., 2.])), ("R", np.array([30., 10., 20.]))])
+    data.errors = {"H": np.zeros(3), "R": np.ones(3)}
+    views = (data.sort("H"), data.where(data["H"] != 2.), data.query(datasets.Column("H") > 1.5))
+    for view in views:
+        expected = {key: view[key] for key in view}
+        for copied in (dict(view), {**view}, view.copy(), datasets.DataSet(view), dict(view.errors)):
+            assert all(isinstance(column, np.ndarray) for column in copied.values())
+        assert all(np.array_equal(dict(view)[key], expected[key]) for key in expected)
+    assert np.array_equal(datasets.DataSet(data.sort("H"))["R"], [10., 20., 30.])
+    
+def test_lazy_dataset_as_dict(tmp_path):
+    data = datasets.DataSet([("x", np.arange(4.)), ("y", np.arange(4.) ** 2)])
+    datasets.save_npy(data, str(tmp_path))
+    loaded = datasets.load_npy(str(tmp_path))
+    assert np.array_equal({**loaded}["y"], data["y"])
+    assert np.array_equal(loaded.pop("x"), data["x"])
+    
+def test_row_view_follows_parent():
+    data = datasets.DataSet([("x", np.array([3., 1., 2., 0., 5.])), ("y", np.array([30., 10., 20., 0., 50.]))])
+    view = data.where(np.array([True, True, False, True, False]))
+    assert np.array_equal(view.sort("x")["y"], [0., 10., 30.])
+    data["y"] = data["y"] * 10.
+    assert np.array_equal(view["y"], [300., 100., 0.])
+    assert np.array_equal(view.sort("x")["y"], [0., 100., 300.])
+    view["y"] = np.ones(3)
+    data["y"] = data["y"] * 10.
+    assert np.array_equal(view.sort("x")["y"], np.ones(3))
+    
+def test_interpolator_follows_changes():
+    data = datasets.DataSet([("x", np.array([2., 1., 3.])), ("y", np.array([20., 10., 30.]))])
+    data.errors = {"x": np.zeros(3), "y": np.array([2., 1., 3.])}
+    assert data.sort("x").interpolator("x", "y")(1.5) == 15.
+    assert data.interpolator("x", "y", errors=True)(1.5) == 1.5
+    assert data.sort("x").interpolator("x", "y", errors=True)(1.5) == 1.5
+    data["y"] = data["y"] * 10.
+    data.errors["y"] = data.errors["y"] * 10.
+    assert data.sort("x").interpolator("x", "y")(1.5) == 150.
+    assert data.interpolator("x", "y", errors=True)(1.5) == 15.
+    assert data.sort("x").interpolator("x", "y", errors=True)(1.5) == 15.
+    
+def _csv_writer_output(data, indices, format_string, csv_params):
+    # what save_csv wrote one cell at a time with csv.writer
+    output = io.StringIO(newline="")
+    writer = csv.writer(output, **csv_params)
+    N = max(i for (i, key) in indices) + 1
+    row = [""] * (2 * N)
+    for (i, key) in indices:
+        (row[i], row[i + N]) = (key, "error({})".format(key))
+    writer.writerow(row)
+    for r in range(data.length):
+        for (i, key) in indices:
+            (row[i], row[i + N]) = (format_string.format(data[key][r]), format_string.format(data.errors[key][r]))
+        writer.writerow(row)
+    return output.getvalue()
+    
+def test_save_csv_matches_csv_writer(tmp_path):
+    data = datasets.DataSet([("x", np.array([1.5, -2.25, 1e-12, np.nan, np.inf, 0.])),
+                             ("y", np.array([3., 1e20, -0., 12345.678, -np.inf, 7.]))])
+    data.errors = {"x": np.full(6, 0.01), "y": np.full(6, 1.)}
+    indices = [(0, "x"), (2, "y")]
+    formats = ("{:.10g}", "{:>12.4f}", "{:12.4e}", "{:<10g}", "{:*^12.3f}", "{: .3f}", "{:010.3f}", "{:,.2f}", "v={:.3g}")
+    dialects = ({}, {"delimiter": " "}, {"delimiter": "\t"}, {"delimiter": ";", "lineterminator": "\n"},
+                {"delimiter": "*"}, {"delimiter": ",", "quotechar": " "}, {"delimiter": "e"})
+    path = str(tmp_path / "data.csv")
+    for format_string in formats:
+        for csv_params in dialects:
+            datasets.save_csv(data, path, indices, format_string=format_string, **csv_params)
+            with open(path, newline="") as f:
+                assert f.read() == _csv_writer_output(data, indices, format_string, csv_params), (format_string, csv_params)
+    
+def test_block_assignment_does_not_write_through(tmp_path):
+    block = np.arange(8.).reshape(2, 4)
+    data = datasets.BlockDataSet(["a", "b"], block)
+    part = data.slice(1, 3)
+    part["a"] = [100., 200.]
+    assert np.array_equal(part["a"], [100., 200.])
+    assert np.array_equal(part.block, [[100., 200.], [5., 6.]])
+    assert np.array_equal(data["a"], [0., 1., 2., 3.])
+    assert np.array_equal(block, np.arange(8.).reshape(2, 4))
+    datasets.save_npy(data, str(tmp_path))
+    loaded = datasets.load_npy(str(tmp_path))
+    loaded["a"] = loaded["a"] * 2.
+    assert np.array_equal(loaded["a"], [0., 2., 4., 6.])
+    assert np.array_equal(datasets.load_npy(str(tmp_path))["a"], [0., 1., 2., 3.])
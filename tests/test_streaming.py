@@ -0,0 +1,25 @@
+import numpy as np
+
+import elflab.datasets as datasets
+from elflab.analysis import streaming
+
+
+def _data():
+    data = datasets.DataSet([("t", np.arange(7.)), ("R", np.arange(7.) * 2.)])
+    data.errors = {"t": np.zeros(7), "R": np.full(7, 0.1)}
+    return data
+    
+def test_assign_with_errors():
+    chunks = streaming.pipeline(datasets.iter_dataset(_data(), 3), streaming.assign("x", lambda chunk: chunk["R"] + 1.))
+    result = streaming.collect(chunks)
+    assert np.array_equal(result["x"], np.arange(7.) * 2. + 1.)
+    assert np.array_equal(result.errors["x"], np.zeros(7))
+    
+def test_concatenate_missing_errors():
+    (first, second) = (_data(), _data())
+    first["x"] = first["R"]
+    second["x"] = second["R"]
+    first.errors["x"] = np.full(7, 0.5)
+    joined = datasets.concatenate([first, second])
+    assert np.array_equal(joined.errors["x"][:7], np.full(7, 0.5))
+    assert np.isnan(joined.errors["x"][7:]).all()
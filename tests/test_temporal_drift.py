@@ -0,0 +1,15 @@
+import numpy as np
+
+import elflab.datasets as datasets
+from elflab.analysis import temporal_drift
+
+
+def test_correct_new_key_with_errors():
+    t = np.arange(6.)
+    data = datasets.DataSet([("time", t), ("R", 10. + 0.5 * t)])
+    data.errors = {"time": np.zeros(6), "R": np.full(6, 0.1)}
+    temporal_drift.correct(data, "R", lambda t: 0.5 * t, new_key="R_corr")
+    assert np.allclose(data["R_corr"], 10.)
+    assert np.array_equal(data.errors["R_corr"], data.errors["R"])
+    joined = datasets.concatenate([data, data])
+    assert np.array_equal(joined.errors["R_corr"], np.full(12, 0.1))
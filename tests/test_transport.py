@@ -0,0 +1,29 @@
+import numpy as np
+
+import elflab.datasets as datasets
+from elflab.analysis import transport
+
+
+def test_van_der_Pauw_set():
+    H = np.linspace(-1., 1., 50)
+    set1 = datasets.DataSet([("H", H), ("R", np.full(50, 10.)), ("err_R", np.full(50, .1))])
+    set2 = datasets.DataSet([("H", H[::2]), ("R", np.full(25, 10.)), ("err_R", np.full(25, .1))])
+    result = transport.van_der_Pauw_set(set1, set2, "H")
+    assert result.length == 49
+    assert np.allclose(result["R"], 10. * np.pi / np.log(2.))
+    assert np.allclose(result["err_R"], np.pi / 2. / np.log(2.) * np.hypot(.1, .1))
+    
+def test_symmetrize_MR_pairs_with_errors():
+    H = np.linspace(-1., 1., 21)
+    pairs = []
+    for i in range(2):
+        data = datasets.DataSet([("H", H), ("R", 1. + H**2 + H), ("err_R", np.full(21, .1))])
+        data.errors = {key: np.zeros(21) for key in data}
+        mirror = datasets.DataSet([("H", -H), ("R", 1. + H**2 - H), ("err_R", np.full(21, .1))])
+        mirror.errors = {key: np.zeros(21) for key in mirror}
+        pairs.append((data, mirror))
+    result = transport.symmetrize_MR_pairs(pairs)
+    assert result.length == 42
+    assert np.allclose(result["R"], 1. + result["H"]**2)
+    assert np.array_equal(result["sweep"], np.repeat([0., 1.], 21))
+    assert np.array_equal(result.errors["sweep"], np.zeros(42))